@@ -0,0 +1,56 @@
+import sys
+import os
+import glob
+import time
+import tempfile
+import numpy as np
+import cv2
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from neural_upscaler.utils.file_io import read_image, save_image, ENCODE_PROFILES
+
+SAMPLES_DIR = 'calibration'
+SCALE = 4
+MAX_SAMPLES = 4
+FORMATS = ['.png', '.jpg', '.webp']
+
+def load_samples(folder:str) -> list:
+    """
+    Готовит представительные x4 результаты: изображения из папки, увеличенные бикубически
+    (по статистике близко к выходу нейросети - гладкие области и резкие края).
+    Готовые результаты апскейла можно положить в папку с суффиксом _upscaled, они берутся как есть.
+    """
+    samples = []
+    for path in sorted(glob.glob(os.path.join(folder, '*.*')))[:MAX_SAMPLES]:
+        img = read_image(path)
+        if img is None:
+            continue
+        if '_upscaled' not in os.path.basename(path):
+            img = cv2.resize(img, None, fx=SCALE, fy=SCALE, interpolation=cv2.INTER_CUBIC)
+        samples.append(img)
+    
+    if not samples:
+        raise RuntimeError(f'No images in {folder}')
+    return samples
+
+def bench_profiles(samples:list):
+    """
+    Для каждого формата и профиля печатает среднее время кодирования с записью на диск и средний размер файла.
+    """
+    pixels = np.mean([img.shape[0] * img.shape[1] for img in samples]) / 1e6
+    print(f'{len(samples)} samples, {pixels:.1f} MPix on average')
+    
+    with tempfile.TemporaryDirectory(prefix='bench_encode_') as temp_dir:
+        for ext in FORMATS:
+            for profile in ENCODE_PROFILES:
+                path = os.path.join(temp_dir, f'out{ext}')
+                elapsed, sizes = 0.0, []
+                
+                for img in samples:
+                    start = time.perf_counter()
+                    save_image(path, img, profile)
+                    elapsed += time.perf_counter() - start
+                    sizes.append(os.path.getsize(path))
+                
+                print(f'  {ext:5} {profile:9} {elapsed / len(samples):7.3f} s  {np.mean(sizes) / 1024**2:7.2f} MB')
+
+bench_profiles(load_samples(sys.argv[1] if len(sys.argv) > 1 else SAMPLES_DIR))
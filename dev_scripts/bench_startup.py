@@ -0,0 +1,45 @@
+import sys
+import os
+import time
+import shutil
+import tempfile
+sys.path.append(os.path.join(os.getcwd(), 'src'))
+from neural_upscaler.engine.upscaler import create_session_options, get_providers_list
+from neural_upscaler.engine.model_cache import create_cached_session
+
+REPEATS = 3
+
+def measure(create) -> float:
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        create()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_model(model_path:str):
+    """
+    Сравнивает время создания сессии: без кэша, с сохранением в кэш и из готового кэша.
+    """
+    providers = get_providers_list()
+    cache_dir = tempfile.mkdtemp(prefix='ort_cache_')
+    
+    try:
+        plain = measure(lambda: create_cached_session(model_path, create_session_options(), providers, None))
+        
+        start = time.perf_counter()
+        create_cached_session(model_path, create_session_options(), providers, cache_dir)
+        first = time.perf_counter() - start
+        
+        cached = measure(lambda: create_cached_session(model_path, create_session_options(), providers, cache_dir))
+    finally:
+        shutil.rmtree(cache_dir)
+    
+    print(f'{os.path.basename(model_path)} [{providers[0]}]')
+    print(f'  no cache:     {plain:.3f} s')
+    print(f'  cache write:  {first:.3f} s')
+    print(f'  cache hit:    {cached:.3f} s ({plain / cached:.2f}x faster)')
+    
+bench_model('weights/RealESRGAN_x2plus_fp16.onnx')
+bench_model('weights/RealESRGAN_x4plus_fp16.onnx')
@@ -0,0 +1,119 @@
+import sys
+import os
+import glob
+import json
+import time
+import numpy as np
+import onnx
+import onnxruntime as ort
+sys.path.append(os.getcwd())
+
+MANIFEST_NAME = 'manifest.json'
+PROBE_SIZE = 64
+BENCH_TILE = 128
+BENCH_REPEATS = 3
+BENCH_PROVIDERS = ['CUDAExecutionProvider', 'DmlExecutionProvider', 'CPUExecutionProvider']
+QUANT_OPS = {'QuantizeLinear', 'DequantizeLinear', 'QLinearConv', 'ConvInteger'}
+
+def get_precision(model:onnx.ModelProto) -> str:
+    if any(node.op_type in QUANT_OPS for node in model.graph.node):
+        return 'int8'
+    elem_type = model.graph.input[0].type.tensor_type.elem_type
+    return 'fp16' if elem_type == onnx.TensorProto.FLOAT16 else 'fp32'
+
+def run(session:ort.InferenceSession, size:int, dtype) -> np.ndarray:
+    blob = np.random.rand(1, 3, size, size).astype(dtype)
+    return session.run(None, {session.get_inputs()[0].name: blob})[0]
+
+def probe_model(path:str) -> dict:
+    """
+    Определяет масштаб, имена входа/выхода, точность и кратность сторон тайла по пробному прогону на CPU.
+    """
+    model = onnx.load(path)
+    session = ort.InferenceSession(path, providers=['CPUExecutionProvider'])
+    dtype = np.float16 if 'float16' in session.get_inputs()[0].type else np.float32
+    
+    output = run(session, PROBE_SIZE, dtype)
+    scale = output.shape[-1] // PROBE_SIZE
+    
+    # x2 модели делают pixel_unshuffle и не принимают нечётные стороны
+    try:
+        run(session, PROBE_SIZE + 1, dtype)
+        tile_align = 1
+    except Exception:
+        tile_align = 2
+    
+    return {
+        'file': os.path.basename(path),
+        'scale': scale,
+        'precision': get_precision(model),
+        'input': session.get_inputs()[0].name,
+        'output': session.get_outputs()[0].name,
+        'tile_align': tile_align,
+    }
+
+def measure_throughput(path:str) -> dict:
+    """
+    Замеряет скорость (мегапикселей входа в секунду) на каждом доступном провайдере.
+    """
+    throughput = {}
+    for provider in BENCH_PROVIDERS:
+        if provider not in ort.get_available_providers():
+            continue
+        try:
+            session = ort.InferenceSession(path, providers=[provider])
+            dtype = np.float16 if 'float16' in session.get_inputs()[0].type else np.float32
+            run(session, BENCH_TILE, dtype)
+            
+            start = time.perf_counter()
+            for _ in range(BENCH_REPEATS):
+                run(session, BENCH_TILE, dtype)
+            elapsed = (time.perf_counter() - start) / BENCH_REPEATS
+            
+            throughput[provider] = round(BENCH_TILE ** 2 / elapsed / 1e6, 4)
+        except Exception as e:
+            print(f'  {provider}: failed ({e})')
+    return throughput
+
+def validate_manifest(weights_dir:str) -> bool:
+    """
+    Проверяет, что каждый вариант из манифеста существует и совпадает с моделью по масштабу, именам и точности.
+    """
+    with open(os.path.join(weights_dir, MANIFEST_NAME), 'r') as file:
+        manifest = json.load(file)
+    
+    ok = True
+    for variant in manifest['models']:
+        path = os.path.join(weights_dir, variant['file'])
+        if not os.path.exists(path):
+            print(f'{variant["file"]}: missing')
+            ok = False
+            continue
+        
+        probed = probe_model(path)
+        for key in ('scale', 'precision', 'input', 'output', 'tile_align'):
+            if probed[key] != variant[key]:
+                print(f'{variant["file"]}: {key} is {probed[key]}, manifest says {variant[key]}')
+                ok = False
+    return ok
+
+def build_manifest(weights_dir:str):
+    """
+    Собирает манифест по всем ONNX моделям в папке и сохраняет его рядом с весами.
+    """
+    variants = []
+    for path in sorted(glob.glob(os.path.join(weights_dir, '*.onnx'))):
+        variant = probe_model(path)
+        variant['throughput'] = measure_throughput(path)
+        print(f'{variant["file"]}: x{variant["scale"]} {variant["precision"]}, {variant["throughput"]}')
+        variants.append(variant)
+    
+    with open(os.path.join(weights_dir, MANIFEST_NAME), 'w') as file:
+        json.dump({'version': 1, 'models': variants}, file, indent=4)
+    
+    if not validate_manifest(weights_dir):
+        raise RuntimeError('Manifest validation failed')
+    print(f'Manifest saved: {len(variants)} models')
+
+if __name__ == '__main__':
+    build_manifest(sys.argv[1] if len(sys.argv) > 1 else 'weights')
@@ -3,6 +3,7 @@ import sys
 import os
 from onnxconverter_common import float16
 sys.path.append(os.getcwd())
+from dev_scripts.build_manifest import build_manifest
 
 def convert_model(input_path:str, output_path:str):
     model = onnx.load(input_path)
@@ -10,4 +11,6 @@ def convert_model(input_path:str, output_path:str):
     onnx.save(model_fp16, output_path)
     
 convert_model('weights/RealESRGAN_x2plus.onnx', 'weights/RealESRGAN_x2plus_fp16.onnx')
-convert_model('weights/RealESRGAN_x4plus.onnx', 'weights/RealESRGAN_x4plus_fp16.onnx')
\ No newline at end of file
+convert_model('weights/RealESRGAN_x4plus.onnx', 'weights/RealESRGAN_x4plus_fp16.onnx')
+
+build_manifest('weights')
\ No newline at end of file
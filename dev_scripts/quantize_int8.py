@@ -0,0 +1,141 @@
+import sys
+import os
+import glob
+import time
+import numpy as np
+import cv2
+import onnxruntime as ort
+from onnxruntime.quantization import quantize_static, CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType
+from onnxruntime.quantization.shape_inference import quant_pre_process
+sys.path.append(os.getcwd())
+from dev_scripts.build_manifest import build_manifest
+
+CALIBRATION_DIR = 'calibration'
+CROP_SIZE = 128 # Кратно 2 и 4, подходит обеим моделям
+CROPS_PER_IMAGE = 4
+MAX_CROPS = 64
+EVAL_CROPS = 16
+
+def load_crops(folder:str, limit:int, seed:int = 0) -> list:
+    """
+    Нарезает случайные куски CROP_SIZE x CROP_SIZE из изображений папки (RGB, uint8).
+    """
+    rng = np.random.default_rng(seed)
+    paths = sorted(p for ext in ('png', 'jpg', 'jpeg', 'webp', 'bmp') for p in glob.glob(os.path.join(folder, f'*.{ext}')))
+    
+    crops = []
+    for path in paths:
+        img = cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None or min(img.shape[:2]) < CROP_SIZE:
+            continue
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+        
+        for _ in range(CROPS_PER_IMAGE):
+            y = rng.integers(0, img.shape[0] - CROP_SIZE + 1)
+            x = rng.integers(0, img.shape[1] - CROP_SIZE + 1)
+            crops.append(img[y:y + CROP_SIZE, x:x + CROP_SIZE])
+            if len(crops) >= limit:
+                return crops
+    
+    if not crops:
+        raise RuntimeError(f'No usable images in {folder}')
+    return crops
+
+def to_blob(crop:np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(crop.transpose(2, 0, 1)[np.newaxis], dtype=np.float32) / 255.0
+
+def to_image(output:np.ndarray) -> np.ndarray:
+    return (np.clip(output[0], 0, 1).transpose(1, 2, 0) * 255.0).round().astype(np.uint8)
+
+class ImageFolderReader(CalibrationDataReader):
+    """
+    Источник калибровочных данных: куски изображений из локальной папки.
+    """
+    def __init__(self, folder:str, input_name:str):
+        self.input_name = input_name
+        self.iterator = iter(load_crops(folder, MAX_CROPS))
+    
+    def get_next(self):
+        crop = next(self.iterator, None)
+        if crop is None:
+            return None
+        return {self.input_name: to_blob(crop)}
+
+def psnr(a:np.ndarray, b:np.ndarray) -> float:
+    mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def ssim(a:np.ndarray, b:np.ndarray) -> float:
+    """
+    SSIM по яркости с гауссовым окном 11x11 (sigma 1.5), как в оригинальной статье.
+    """
+    a = cv2.cvtColor(a, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    b = cv2.cvtColor(b, cv2.COLOR_RGB2GRAY).astype(np.float64)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    
+    blur = lambda x: cv2.GaussianBlur(x, (11, 11), 1.5)
+    mu_a, mu_b = blur(a), blur(b)
+    var_a = blur(a * a) - mu_a ** 2
+    var_b = blur(b * b) - mu_b ** 2
+    cov = blur(a * b) - mu_a * mu_b
+    
+    ssim_map = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim_map.mean())
+
+def quantize_model(fp32_path:str, int8_path:str, calibration_dir:str):
+    """
+    Статическая INT8 квантизация (QDQ, веса по каналам) с калибровкой на папке изображений.
+    """
+    prepared_path = fp32_path.replace('.onnx', '_prep.onnx')
+    quant_pre_process(fp32_path, prepared_path)
+    
+    input_name = ort.InferenceSession(prepared_path, providers=['CPUExecutionProvider']).get_inputs()[0].name
+    
+    quantize_static(
+        prepared_path,
+        int8_path,
+        ImageFolderReader(calibration_dir, input_name),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+        calibrate_method=CalibrationMethod.MinMax
+    )
+    os.remove(prepared_path)
+
+def evaluate(fp32_path:str, int8_path:str, calibration_dir:str):
+    """
+    Сравнивает INT8 модель с FP32 по PSNR/SSIM и скорости на CPU.
+    """
+    crops = load_crops(calibration_dir, EVAL_CROPS, seed=1)
+    sessions = {
+        'fp32': ort.InferenceSession(fp32_path, providers=['CPUExecutionProvider']),
+        'int8': ort.InferenceSession(int8_path, providers=['CPUExecutionProvider']),
+    }
+    
+    results = {name: [] for name in sessions}
+    timings = {name: 0.0 for name in sessions}
+    
+    for crop in crops:
+        blob = to_blob(crop)
+        for name, session in sessions.items():
+            start = time.perf_counter()
+            output = session.run(None, {session.get_inputs()[0].name: blob})[0]
+            timings[name] += time.perf_counter() - start
+            results[name].append(to_image(output))
+    
+    psnr_values = [psnr(a, b) for a, b in zip(results['fp32'], results['int8'])]
+    ssim_values = [ssim(a, b) for a, b in zip(results['fp32'], results['int8'])]
+    
+    pixels = len(crops) * CROP_SIZE ** 2
+    print(f'{os.path.basename(int8_path)}: PSNR {np.mean(psnr_values):.2f} dB, SSIM {np.mean(ssim_values):.4f} (vs FP32)')
+    for name, elapsed in timings.items():
+        print(f'  {name}: {pixels / elapsed / 1e6:.3f} MPix/s')
+
+for name in ('RealESRGAN_x2plus', 'RealESRGAN_x4plus'):
+    fp32_path = f'weights/{name}.onnx'
+    int8_path = f'weights/{name}_int8.onnx'
+    quantize_model(fp32_path, int8_path, CALIBRATION_DIR)
+    evaluate(fp32_path, int8_path, CALIBRATION_DIR)
+
+build_manifest('weights')
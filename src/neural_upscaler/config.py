@@ -6,6 +6,7 @@ class ConfigManager():
     def __init__(self):
         path = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.AppConfigLocation)
         os.makedirs(path, exist_ok=True)
+        self.config_dir = path
         self.config_path = os.path.join(path, 'settings.json')
     
     def save_config(self, data):
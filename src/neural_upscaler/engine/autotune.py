@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+import numpy as np
+from neural_upscaler.engine.upscaler import Upscaler, get_providers_list
+from neural_upscaler.utils.system import get_cpu_threads, get_machine_fingerprint
+
+CANDIDATE_TILE_SIZES = [128, 192, 256, 384, 512, 768]
+REFERENCE_TILE_SIZE = 192 # Размер тайла, на котором сравниваются настройки сессии
+BENCHMARK_REPEATS = 2
+MAX_RUN_SECONDS = 5.0 # Более медленные тайлы не проверяются, чтобы замер оставался коротким
+TILE_PAD = 10
+
+def get_session_candidates(provider:str) -> list:
+    """
+    Возвращает варианты настроек сессии для замера.
+    На GPU потоки процессора почти не влияют на скорость, поэтому проверяются только настройки по умолчанию.
+    """
+    if provider != 'CPUExecutionProvider':
+        return [{'execution_mode': 'sequential'}]
+    
+    physical, logical = get_cpu_threads()
+    
+    candidates = []
+    for threads in sorted({physical, logical}):
+        candidates.append({'execution_mode': 'sequential', 'intra_op_threads': threads, 'inter_op_threads': 1})
+    
+    if physical >= 4:
+        candidates.append({'execution_mode': 'parallel', 'intra_op_threads': physical // 2, 'inter_op_threads': 2})
+    
+    return candidates
+
+def measure_tile(upscaler:Upscaler, tile_size:int) -> float:
+    """
+    Замеряет скорость обработки одного тайла на синтетических данных.
+    Возвращает количество полезных (без перекрытия) пикселей в секунду.
+    """
+    side = tile_size + TILE_PAD * 2
+    patch = np.random.randint(0, 256, (side, side, 3), dtype=np.uint8)
+    
+    upscaler.process_batch([patch]) # Прогрев: выделение памяти и выбор ядер под форму входа
+    
+    best = None
+    for _ in range(BENCHMARK_REPEATS):
+        start = time.perf_counter()
+        upscaler.process_batch([patch])
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    
+    return tile_size ** 2 / best
+
+def run_autotune(model_path:str, scale:int) -> dict:
+    """
+    Подбирает настройки сессии и размер тайла короткими замерами.
+    Сначала сравниваются настройки сессии на эталонном тайле, затем для лучших настроек подбирается размер тайла.
+    """
+    provider = get_providers_list()[0]
+    
+    best_options, best_speed = None, 0
+    for candidate in get_session_candidates(provider):
+        upscaler = Upscaler(model_path, scale, tuning=dict(candidate, tile_size=REFERENCE_TILE_SIZE))
+        speed = measure_tile(upscaler, REFERENCE_TILE_SIZE)
+        logging.info(f'Autotune: {candidate} -> {speed / 1e6:.3f} MPix/s')
+        
+        if speed > best_speed:
+            best_options, best_speed = candidate, speed
+    
+    upscaler = Upscaler(model_path, scale, tuning=dict(best_options, tile_size=REFERENCE_TILE_SIZE))
+    
+    best_tile, best_speed = REFERENCE_TILE_SIZE, 0
+    for tile_size in CANDIDATE_TILE_SIZES:
+        if tile_size > upscaler.max_tile_size:
+            break
+        
+        start = time.perf_counter()
+        try:
+            speed = measure_tile(upscaler, tile_size)
+        except RuntimeError as e:
+            logging.warning(f'Autotune: tile {tile_size} failed: {e}')
+            break
+        logging.info(f'Autotune: tile {tile_size} -> {speed / 1e6:.3f} MPix/s')
+        
+        if speed > best_speed:
+            best_tile, best_speed = tile_size, speed
+        
+        if time.perf_counter() - start > MAX_RUN_SECONDS * (BENCHMARK_REPEATS + 1):
+            break
+    
+    return dict(best_options, tile_size=best_tile, pixels_per_second=best_speed, provider=upscaler.provider)
+
+def get_tuning_key(model_path:str, provider:str) -> str:
+    stat = os.stat(model_path)
+    model_key = f'{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}'
+    return f'{model_key}|{provider}|{get_machine_fingerprint()}'
+
+def load_tuning(cache_path:str, key:str) -> dict|None:
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with open(cache_path, 'r') as file:
+            return json.load(file).get(key)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Failed to read autotune cache: {e}')
+        return None
+
+def save_tuning(cache_path:str, key:str, tuning:dict):
+    data = {}
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'r') as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            data = {}
+    
+    data[key] = tuning
+    with open(cache_path, 'w') as file:
+        json.dump(data, file, indent=4)
+
+def get_tuning(model_path:str, scale:int, cache_path:str, allow_benchmark:bool = True) -> dict|None:
+    """
+    Возвращает сохранённые настройки для модели, провайдера и машины.
+    Если их нет, выполняет замер и сохраняет результат.
+    - cache_path: путь к файлу с результатами замеров (в папке настроек приложения).
+    - allow_benchmark: False - вернуть None вместо замера, если сохранённых настроек нет.
+    """
+    key = get_tuning_key(model_path, get_providers_list()[0])
+    
+    tuning = load_tuning(cache_path, key)
+    if tuning is not None:
+        logging.info(f'Loaded autotune results: {tuning}')
+        return tuning
+    
+    if not allow_benchmark:
+        return None
+    
+    logging.info('No autotune results for this model and machine. Benchmarking...')
+    tuning = run_autotune(model_path, scale)
+    logging.info(f'Autotune winner: {tuning}')
+    
+    save_tuning(cache_path, key, tuning)
+    return tuning
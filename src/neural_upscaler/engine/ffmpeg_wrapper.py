@@ -1,12 +1,198 @@
 import subprocess
 import logging
+import json
 import os
+import time
+import threading
+from fractions import Fraction
 
 CREATE_NO_WINDOW = 0x08000000 if os.name == 'nt' else 0
+PIPE_BUFFER_FRAMES = 2 # Размер буфера чтения из декодера в кадрах
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow', 'slower', 'veryslow'] # От быстрого к меньшему размеру
 
-def start_ffmpeg_process(output_path:str, fps:float, width:int, height:int, input_source=None):
+# Допустимые пресеты x264 (самый быстрый, самый медленный) для профилей сжатия из file_io.ENCODE_PROFILES.
+# Качество задаёт CRF, пресет влияет в основном на размер файла и нагрузку на процессор
+X264_PRESET_RANGES = {
+    'fast': ('ultrafast', 'veryfast'),
+    'balanced': ('veryfast', 'medium'),
+    'smallest': ('medium', 'slow'),
+}
+
+def probe_video(path:str, count_frames:bool = True) -> dict|None:
+    """
+    Читает параметры первой видеодорожки через ffprobe.
+    Возвращает словарь: width, height (с учётом поворота), frames (число пакетов - точное даже для VFR и MKV),
+    fps (Fraction), rotation (градусы), pix_fmt, start_time (начало файла в секундах, от него отсчитывается -ss).
+    None - ffprobe недоступен или файл не распознан.
+    - count_frames: считать пакеты. Для этого ffprobe читает весь файл, поэтому без подсчёта frames берётся
+      из заголовка контейнера или оценивается по длительности (точное число даёт probe_keyframes).
+    """
+    cmd = ['ffprobe', '-v', 'error', '-select_streams', 'v:0']
+    if count_frames:
+        cmd += ['-count_packets']
+    cmd += [
+        '-show_entries', 'stream=width,height,pix_fmt,avg_frame_rate,r_frame_rate,nb_frames,nb_read_packets:stream_tags=rotate:stream_side_data=rotation:format=start_time,duration',
+        '-of', 'json',
+        path
+    ]
+    
+    try:
+        result = subprocess.run(cmd, capture_output=True, check=True, creationflags=CREATE_NO_WINDOW)
+        info = json.loads(result.stdout)
+        stream = info['streams'][0]
+    except (OSError, subprocess.CalledProcessError, ValueError, KeyError, IndexError) as e:
+        logging.warning(f'ffprobe failed for {path}: {e}')
+        return None
+    
+    # Для VFR avg_frame_rate - средняя частота, r_frame_rate - частота временной базы
+    fps = Fraction(stream.get('avg_frame_rate', '0/1'))
+    if fps <= 0:
+        fps = Fraction(stream.get('r_frame_rate', '0/1'))
+    
+    rotation = 0
+    for side_data in stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            rotation = int(side_data['rotation'])
+    if not rotation:
+        rotation = int(stream.get('tags', {}).get('rotate', 0))
+    
+    frames = int(stream.get('nb_read_packets') or stream.get('nb_frames') or 0)
+    if not frames and fps > 0:
+        frames = round(float(info.get('format', {}).get('duration', 0)) * fps)
+    
+    width, height = stream['width'], stream['height']
+    # FFmpeg поворачивает кадры при декодировании, поэтому стороны меняются местами
+    if abs(rotation) % 180 == 90:
+        width, height = height, width
+    
+    return {
+        'width': width,
+        'height': height,
+        'frames': frames,
+        'fps': fps,
+        'rotation': rotation,
+        'pix_fmt': stream.get('pix_fmt'),
+        'start_time': float(info.get('format', {}).get('start_time', 0)),
+    }
+
+def start_decoder_process(input_path:str, width:int, height:int, threads:int = 0, start:float|None = None, frames:int|None = None,
+                          scale:bool = False):
+    """
+    Запускает FFmpeg, декодирующий видео в сырые кадры bgr24 в stdout.
+    Кадры не пропускаются и не дублируются (passthrough), поэтому их число совпадает с probe_video.
+    - threads: потоки декодера. 0 - автоматически.
+    - start, frames: декодировать только frames кадров начиная со времени start (ключевого кадра).
+    - scale: привести кадры к width x height (уменьшение входа в режиме целевого размера).
+    """
+    cmd = ['ffmpeg', '-v', 'error', '-threads', str(threads)]
+    if start is not None:
+        cmd += ['-ss', str(start)]
+    cmd += [
+        '-i', input_path,
+        '-map', '0:v:0',
+        '-fps_mode', 'passthrough',
+    ]
+    if frames is not None:
+        cmd += ['-frames:v', str(frames)]
+    if scale:
+        cmd += ['-vf', f'scale={width}:{height}:flags=area']
+    cmd += [
+        '-f', 'rawvideo',
+        '-pix_fmt', 'bgr24',
+        '-'
+    ]
+    
+    logging.info(f'Starting FFmpeg decoder: {cmd}')
+    
+    return subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        bufsize=width * height * 3 * PIPE_BUFFER_FRAMES,
+        creationflags=CREATE_NO_WINDOW
+    )
+
+def probe_keyframes(path:str) -> tuple:
+    """
+    Возвращает ключевые кадры первой видеодорожки и общее число кадров: (список (время в секундах, номер кадра), кадры).
+    Номер кадра считается по пакетам, поэтому разница номеров соседних ключевых кадров - число кадров между ними,
+    а число пакетов совпадает с frames от probe_video с подсчётом.
+    (None, 0) - ffprobe недоступен.
+    """
+    cmd = [
+        'ffprobe', '-v', 'error',
+        '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags',
+        '-of', 'csv=p=0',
+        path
+    ]
+    
+    try:
+        result = subprocess.run(cmd, capture_output=True, check=True, creationflags=CREATE_NO_WINDOW)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.warning(f'ffprobe failed for {path}: {e}')
+        return None, 0
+    
+    keyframes = []
+    packets = result.stdout.decode('utf-8', errors='ignore').splitlines()
+    for index, line in enumerate(packets):
+        pts_time, _, flags = line.partition(',')
+        if 'K' in flags and pts_time not in ('', 'N/A'):
+            keyframes.append((float(pts_time), index))
+    return keyframes, len(packets)
+
+def concat_segments(list_path:str, output_path:str, audio_source:str|None = None) -> bool:
+    """
+    Склеивает готовые части видео без перекодирования (concat demuxer) и добавляет звук из audio_source.
+    - list_path: файл со списком частей в формате concat demuxer.
+    """
+    cmd = ['ffmpeg', '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_source:
+        cmd += ['-i', audio_source, '-map', '0:v', '-map', '1:a?']
+    cmd += ['-c', 'copy', output_path]
+    
+    logging.info(f'Joining segments: {cmd}')
+    result = subprocess.run(cmd, capture_output=True, creationflags=CREATE_NO_WINDOW)
+    if result.returncode != 0:
+        logging.error(f'FFmpeg concat failed: {result.stderr.decode("utf-8", errors="ignore")}')
+        return False
+    return True
+
+class EncoderProgress:
+    """
+    Читает в фоновом потоке отчёты -progress энкодера из его stdout: число закодированных кадров и скорость.
+    Скорость считается по времени отчётов: FFmpeg при вводе из pipe сообщает fps=0.
+    """
+    def __init__(self, process):
+        self.frames = 0
+        self.started = time.perf_counter()
+        self.updated = self.started
+        self.thread = threading.Thread(target=self.read, args=(process.stdout,), daemon=True)
+        self.thread.start()
+    
+    @property
+    def fps(self) -> float:
+        elapsed = self.updated - self.started
+        return self.frames / elapsed if elapsed > 0 else 0.0
+    
+    def read(self, stream):
+        for line in stream:
+            key, _, value = line.decode('utf-8', errors='ignore').strip().partition('=')
+            if key == 'frame' and value.isdigit():
+                self.frames = int(value)
+                self.updated = time.perf_counter()
+    
+    def join(self, timeout:float|None = None):
+        self.thread.join(timeout)
+
+def start_ffmpeg_process(output_path:str, fps:float|Fraction, width:int, height:int, input_source=None, preset:str = 'medium', threads:int = 0,
+                         output_size:tuple|None = None):
     """
     Запускает FFmpeg в режиме ожидания сырых кадров через PIPE (stdin).
+    Отчёты о ходе кодирования идут в stdout, их нужно читать (см. EncoderProgress), иначе FFmpeg остановится на полном pipe.
+    - preset: пресет x264.
+    - threads: потоки энкодера. 0 - автоматически (по числу ядер).
+    - output_size: (ширина, высота) результата, если он отличается от кадров на входе (режим целевого размера).
     """
     cmd = [
         'ffmpeg',
@@ -28,12 +214,18 @@ def start_ffmpeg_process(output_path:str, fps:float, width:int, height:int, inpu
     else:
         cmd += ['-map', '0:v']
     
+    if output_size and tuple(output_size) != (width, height):
+        cmd += ['-vf', f'scale={output_size[0]}:{output_size[1]}:flags=bicubic']
+    
     cmd += [
         '-c:v', 'libx264',
         '-pix_fmt', 'yuv420p',
-        '-preset', 'medium',
+        '-preset', preset,
         '-crf', '18',
+        '-threads', str(threads),
         '-c:a', 'copy',
+        '-progress', 'pipe:1',
+        '-nostats',
         output_path
     ]
     
@@ -42,7 +234,7 @@ def start_ffmpeg_process(output_path:str, fps:float, width:int, height:int, inpu
     return subprocess.Popen(
         cmd, 
         stdin=subprocess.PIPE,
-        stdout=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
         stderr=subprocess.DEVNULL, 
         creationflags=CREATE_NO_WINDOW
     )
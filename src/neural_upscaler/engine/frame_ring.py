@@ -0,0 +1,52 @@
+import queue
+import numpy as np
+
+class FrameRing:
+    """
+    Кольцо кадров одного размера в одном заранее выделенном массиве. Между стадиями конвейера передаются номера слотов,
+    а не массивы: декодер пишет кадр прямо в слот, нейросеть пишет результат в слот, а писатель отдаёт FFmpeg
+    memoryview слота, без копий кадра. Свободные слоты выдаёт acquire, возвращает release.
+    Все стадии - потоки одного процесса, поэтому кольцо живёт в обычной памяти процесса: общая память (/dev/shm)
+    в контейнере бывает мала, а её нехватка проявляется не ошибкой, а SIGBUS при первой записи в слот.
+    """
+    def __init__(self, shape:tuple, slots:int):
+        """
+        - shape: форма кадра (h, w, c), uint8.
+        - slots: количество слотов.
+        """
+        self.shape = tuple(shape)
+        self.slots = slots
+        self.frames = np.empty((slots, *self.shape), dtype=np.uint8)
+        
+        self.free_slots = queue.Queue()
+        for slot in range(slots):
+            self.free_slots.put(slot)
+    
+    def __getitem__(self, slot:int) -> np.ndarray:
+        return self.frames[slot]
+    
+    def view(self, slot:int) -> memoryview:
+        """
+        Байты слота без копирования, например для записи в pipe.
+        """
+        return memoryview(self.frames[slot]).cast('B')
+    
+    def acquire(self, stop_event=None) -> int|None:
+        """
+        Ждёт свободный слот. Возвращает None, если за время ожидания установлен stop_event.
+        """
+        while stop_event is None or not stop_event.is_set():
+            try:
+                return self.free_slots.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+    
+    def release(self, slot:int):
+        self.free_slots.put(slot)
+    
+    def close(self):
+        """
+        Отпускает память кольца. Массивы кольца после этого использовать нельзя.
+        """
+        self.frames = None
@@ -0,0 +1,214 @@
+import os
+import threading
+import queue
+import logging
+import concurrent.futures
+from neural_upscaler.utils.file_io import read_image, read_image_size, save_image, DEFAULT_ENCODE_PROFILE
+from neural_upscaler.engine.memory import MemoryGovernor
+from neural_upscaler.engine.planning import get_target_size
+
+class ImageBatchWorker:
+    """
+    Конвейер для пачки изображений по образцу VideoUpscaleWorker:
+    пул декодирования заранее читает следующие файлы, вызывающий поток гоняет нейросеть,
+    пул кодирования сохраняет готовые результаты. Очереди ограничены, поэтому одновременно
+    в памяти не больше queue_size входов и queue_size выходов (плюс те, что уже в работе у пулов).
+    Кроме того, вход и выход каждого файла учитываются в бюджете памяти: чтение следующих файлов ждёт,
+    пока сохранённые результаты не освободят место.
+    После остановки уже готовые результаты всё равно сохраняются, а память каждого взятого из очередей файла
+    возвращается в бюджет, даже если файл так и не был обработан.
+    """
+    def __init__(self, upscaler, decode_workers:int = 2, encode_workers:int = 2, queue_size:int = 4, encode_profile:str = DEFAULT_ENCODE_PROFILE,
+                 governor:MemoryGovernor|None = None, target_size:int|None = None):
+        """
+        - target_size: меньшая сторона результата (см. Upscaler.process_to_size). None - результат в масштабе модели.
+        """
+        self.upscaler = upscaler
+        self.target_size = target_size
+        self.governor = governor or MemoryGovernor()
+        self.encode_profile = encode_profile
+        self.decode_workers = decode_workers
+        self.encode_workers = encode_workers
+        self.read_queue = queue.Queue(maxsize=queue_size)
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.stop_event = threading.Event()
+        self.results_done = threading.Event() # Нейросеть больше не добавит результатов в write_queue
+        
+        self.lock = threading.Lock()
+        self.done = 0
+        self.failed = []
+    
+    def put_item(self, target:queue.Queue, item) -> bool:
+        """
+        Кладёт элемент в очередь, пока не установлен stop_event. Возвращает False, если обработка остановлена.
+        """
+        while not self.stop_event.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def estimate_memory(self, path:str) -> int:
+        """
+        Память на файл: вход и результат. 0 - размер не удалось узнать по заголовку.
+        """
+        size = read_image_size(path)
+        if not size:
+            return 0
+        h, w = size
+        if self.target_size:
+            target_w, target_h = get_target_size(w, h, self.target_size)
+            return (h * w + target_w * target_h) * 3
+        return h * w * 3 * (1 + self.upscaler.scale ** 2)
+    
+    def reader_thread(self, jobs:list):
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix='decode')
+        try:
+            for job in jobs:
+                memory = self.estimate_memory(job[0])
+                if not self.governor.reserve(memory, self.stop_event):
+                    break
+                future = pool.submit(read_image, job[0])
+                if not self.put_item(self.read_queue, (job, future, memory)):
+                    self.governor.release(memory)
+                    break
+        finally:
+            # Без остановки ещё не прочитанные файлы ждёт нейросеть, отменяются они только после stop_event
+            pool.shutdown(wait=False, cancel_futures=self.stop_event.is_set())
+            self.put_item(self.read_queue, None)
+    
+    def writer_thread(self, total:int, progress):
+        # Очередь дочитывается и после остановки: готовые результаты сохраняются, а их память освобождается
+        while True:
+            try:
+                item = self.write_queue.get(timeout=0.1)
+            except queue.Empty:
+                if self.results_done.is_set() and self.write_queue.empty():
+                    break
+                continue
+            
+            input_path, output_path, img, memory = item
+            try:
+                save_image(output_path, img, self.encode_profile)
+            except Exception as e:
+                logging.error(f'Error saving image {output_path}: {e}')
+                self.mark_done(input_path, total, progress, failed=True)
+                continue
+            finally:
+                del img
+                self.governor.release(memory)
+            
+            self.mark_done(input_path, total, progress)
+    
+    def report_flat_tiles(self, path:str):
+        """
+        Пишет в лог долю однородных тайлов изображения, увеличенных интерполяцией (см. Upscaler.process_image).
+        """
+        flat, checked = self.upscaler.flat_tiles, self.upscaler.checked_tiles
+        if checked:
+            logging.info(f'Flat tiles in {os.path.basename(path)}: {flat} of {checked} ({flat / checked:.0%}) upscaled by interpolation')
+        else:
+            logging.info(f'{os.path.basename(path)} fits into one tile, flat tile check skipped')
+    
+    def mark_done(self, path:str, total:int, progress, failed:bool = False):
+        with self.lock:
+            self.done += 1
+            if failed:
+                self.failed.append(path)
+            percent = int(self.done / total * 100)
+        
+        if progress:
+            progress(percent)
+    
+    def process_images(self, jobs:list, progress=None, on_file=None, on_tiles=None) -> bool:
+        """
+        Обрабатывает список изображений.
+        Возвращает False, если обработка была остановлена. Пути файлов, которые не удалось прочитать,
+        обработать или сохранить, остаются в self.failed.
+        - jobs: список пар (путь к входу, путь к результату).
+        - progress: функция, принимающая процент готовых файлов.
+        - on_file: функция (номер, путь к входу), вызывается перед обработкой каждого файла.
+        - on_tiles: функция (номер, готово тайлов, всего тайлов, оставшееся время или None) - ход обработки файла (см. TileProgress).
+        """
+        self.done = 0
+        self.failed = []
+        self.results_done.clear()
+        total = len(jobs)
+        
+        thread_reader = threading.Thread(target=self.reader_thread, args=(jobs,))
+        threads_writer = [threading.Thread(target=self.writer_thread, args=(total, progress)) for _ in range(self.encode_workers)]
+        
+        thread_reader.start()
+        for thread in threads_writer:
+            thread.start()
+        
+        index = 0
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    item = self.read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                
+                if item is None:
+                    break
+                
+                (input_path, output_path), future, memory = item
+                index += 1
+                if on_file:
+                    on_file(index, input_path)
+                
+                tile_progress = (lambda done, count, eta: on_tiles(index, done, count, eta)) if on_tiles else None
+                queued = False
+                try:
+                    img = future.result()
+                    if img is None:
+                        raise ValueError('unsupported or corrupted file')
+                    if self.target_size:
+                        size = get_target_size(img.shape[1], img.shape[0], self.target_size)
+                        result = self.upscaler.process_to_size(img, size, check_interrupt=self.stop_event.is_set, progress=tile_progress)
+                    else:
+                        result = self.upscaler.process_image(img, check_interrupt=self.stop_event.is_set, progress=tile_progress)
+                    del img
+                    self.report_flat_tiles(input_path)
+                    # Кодировщики работают до results_done, поэтому готовый результат ставится в очередь и после остановки
+                    self.write_queue.put((input_path, output_path, result, memory))
+                    queued = True
+                except InterruptedError:
+                    self.stop_event.set() # Отмена через Upscaler.cancel должна остановить и чтение с сохранением
+                    break
+                except Exception as e:
+                    logging.error(f'Error processing image {input_path}: {e}')
+                    self.mark_done(input_path, total, progress, failed=True)
+                finally:
+                    if not queued:
+                        self.governor.release(memory) # Иначе память освободит кодировщик после сохранения
+        except BaseException:
+            self.stop_event.set()
+            raise
+        finally:
+            self.results_done.set()
+            thread_reader.join()
+            
+            # Файлы, прочитанные заранее, но не дошедшие до нейросети из-за остановки
+            while True:
+                try:
+                    item = self.read_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    _, future, memory = item
+                    future.cancel()
+                    self.governor.release(memory)
+            
+            for thread in threads_writer:
+                thread.join()
+        
+        if self.stop_event.is_set():
+            logging.info('Image batch was stopped by user.')
+            return False
+        
+        logging.info(f'Image batch completed: {total - len(self.failed)} of {total} files.')
+        return True
@@ -0,0 +1,148 @@
+import os
+import gc
+import logging
+import numpy as np
+import cv2
+import psutil
+from neural_upscaler.utils.file_io import read_image, PngStreamWriter, MemmapImageWriter, ENCODE_PROFILES, DEFAULT_ENCODE_PROFILE
+from neural_upscaler.engine.planning import plan_for_scale, resize_image
+
+BUDGET_FRACTION = 0.25 # Доля свободной памяти, которую можно занять под одно изображение
+MIN_BAND_ROWS = 32
+MAX_WARP_COLS = 16384 # cv2.warpAffine не принимает изображения шире SHRT_MAX, широкие полосы делятся по столбцам
+
+def get_memory_budget() -> int:
+    """
+    Бюджет памяти (в байтах) на обработку одного изображения по умолчанию.
+    """
+    return int(psutil.virtual_memory().available * BUDGET_FRACTION)
+
+def estimate_memory(h:int, w:int, scale:int) -> int:
+    """
+    Примерный пик памяти при обработке изображения целиком: вход с рабочими копиями и выходной холст.
+    """
+    return h * w * 3 * 4 + h * w * scale * scale * 3
+
+def needs_out_of_core(h:int, w:int, scale:int, budget:int) -> bool:
+    return estimate_memory(h, w, scale) > budget
+
+def get_band_rows(w:int, scale:int, tile_size:int, budget:int) -> int:
+    """
+    Высота полосы входа (с контекстом), которая укладывается в бюджет.
+    Полоса кратна tile_size, чтобы не порождать лишних рядов тайлов.
+    - budget: бюджет на полосу, без учёта самого входа (см. process_large_image).
+    """
+    # Полоса входа с копиями внутри process_image, выход полосы и его отфильтрованная копия для кодера
+    per_row = w * 3 * (4 + scale * scale * 2)
+    rows = max(budget, 0) // per_row
+    
+    if rows >= tile_size:
+        return rows // tile_size * tile_size
+    return max(rows, MIN_BAND_ROWS)
+
+def stage_input(path:str, work_dir:str, size:tuple|None = None, scale:int = 1, budget:int|None = None) -> np.memmap|None:
+    """
+    Декодирует изображение и переносит его в файл, отображённый в память.
+    OpenCV не умеет декодировать по частям, поэтому целиком в памяти оказывается только вход и только на время переноса.
+    - size, scale: режим целевого размера. Вход сразу приводится к входу модели с масштабом scale по plan_for_scale.
+    - budget: бюджет памяти. Если декодированный вход сам больше бюджета, это пишется в лог: соблюсти бюджет нельзя.
+    """
+    img = read_image(path)
+    if img is None:
+        return None
+    if budget is not None and img.nbytes > budget:
+        logging.warning(f'Decoded input {img.nbytes / 1024**3:.2f} GB exceeds memory budget {budget / 1024**3:.2f} GB while staging: '
+                        f'the image cannot be decoded by rows')
+    if size:
+        img = resize_image(img, plan_for_scale(img.shape[1], img.shape[0], size, scale)['input'])
+    
+    staged = np.memmap(os.path.join(work_dir, f'input_{os.getpid()}.raw'), dtype=np.uint8, mode='w+', shape=img.shape)
+    staged[:] = img
+    staged.flush()
+    return staged
+
+def resize_band(band:np.ndarray, top:int, rows:tuple, size:tuple, source_h:int) -> np.ndarray:
+    """
+    Приводит полосу результата нейросети к итоговому размеру size (ширина, высота) и возвращает строки rows (начало, конец)
+    итогового изображения. По ширине полоса масштабируется целиком, а по высоте строки считаются в координатах
+    всего изображения, как это сделал бы cv2.resize, поэтому на стыках полос нет швов.
+    - band: полоса результата нейросети вместе с контекстом. top - номер её первой строки во всём результате.
+    - source_h: высота всего результата нейросети.
+    """
+    out_w, out_h = size
+    band = resize_image(band, (out_w, band.shape[0]))
+    
+    fy = source_h / out_h
+    interpolation = cv2.INTER_CUBIC if fy < 1 else cv2.INTER_LINEAR
+    result = np.empty((rows[1] - rows[0], out_w, band.shape[2]), dtype=np.uint8)
+    for x in range(0, out_w, MAX_WARP_COLS):
+        columns = band[:, x:x + MAX_WARP_COLS]
+        matrix = np.float32([[1, 0, 0], [0, fy, (rows[0] + 0.5) * fy - 0.5 - top]])
+        result[:, x:x + MAX_WARP_COLS] = cv2.warpAffine(columns, matrix, (columns.shape[1], result.shape[0]),
+                                                        flags=interpolation | cv2.WARP_INVERSE_MAP, borderMode=cv2.BORDER_REPLICATE)
+    return result
+
+def process_large_image(upscaler, input_path:str, output_path:str, work_dir:str, budget:int, tile_pad:int = 10,
+                        check_interrupt=None, progress=None, encode_profile:str = DEFAULT_ENCODE_PROFILE, size:tuple|None = None) -> bool:
+    """
+    Обрабатывает изображение, которое не помещается в память, полосами строк.
+    Каждая полоса берётся из входа вместе с tile_pad строками настоящего контекста сверху и снизу,
+    проходит через process_image, и в выход уходит только её центральная часть.
+    PNG пишется потоково, остальные форматы собираются в холсте на диске (см. MemmapImageWriter).
+    Возвращает False, если изображение не удалось прочитать.
+    - budget: бюджет памяти в байтах, от него зависит высота полосы.
+    - progress: функция, принимающая процент выполнения.
+    - encode_profile: профиль кодирования результата (см. ENCODE_PROFILES).
+    - size: (ширина, высота) результата в режиме целевого размера. Вход уменьшается заранее (см. stage_input),
+      а каждая полоса результата приводится к size по мере записи (см. resize_band). None - результат в масштабе модели.
+    """
+    s = upscaler.scale
+    staged = stage_input(input_path, work_dir, size, s, budget)
+    if staged is None:
+        return False
+    staged_path = staged.filename
+    
+    h, w, _ = staged.shape
+    out_w, out_h = size or (w * s, h * s)
+    resize = (out_w, out_h) != (w * s, h * s)
+    # Прочитанные страницы входа на диске к концу обработки остаются в памяти процесса (их видно в RSS),
+    # поэтому полосы получают бюджет за вычетом всего входа
+    band_rows = get_band_rows(w, s, upscaler.tile_size, budget - staged.nbytes)
+    core_rows = max(band_rows - tile_pad * 2, MIN_BAND_ROWS)
+    logging.info(f'Out-of-core mode for {w}x{h}: bands of {core_rows} rows, budget {budget / 1024**3:.2f} GB'
+                 + (f', output resized to {out_w}x{out_h}' if resize else ''))
+    
+    if os.path.splitext(output_path)[1].lower() == '.png':
+        writer = PngStreamWriter(output_path, out_w, out_h, *ENCODE_PROFILES[encode_profile]['zlib'])
+    else:
+        writer = MemmapImageWriter(output_path, out_w, out_h, work_dir, encode_profile)
+    
+    try:
+        for y0 in range(0, h, core_rows):
+            y1 = min(y0 + core_rows, h)
+            top = max(y0 - tile_pad, 0)
+            bottom = min(y1 + tile_pad, h)
+            
+            band = np.ascontiguousarray(staged[top:bottom])
+            band_up = upscaler.process_image(band, tile_pad, check_interrupt)
+            if resize:
+                # Полосе достаются строки результата, центры которых попадают в её центральную часть
+                rows = (round(y0 * out_h / h), round(y1 * out_h / h) if y1 < h else out_h)
+                writer.write(resize_band(band_up, top * s, rows, (out_w, out_h), h * s))
+            else:
+                writer.write(band_up[(y0 - top) * s:(y1 - top) * s])
+            
+            del band, band_up
+            if progress:
+                progress(int(y1 / h * 100))
+        
+        writer.close()
+    except BaseException:
+        writer.abort()
+        raise
+    finally:
+        staged = None
+        gc.collect()
+        os.remove(staged_path)
+    
+    return True
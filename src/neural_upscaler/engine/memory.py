@@ -0,0 +1,86 @@
+import logging
+import threading
+import psutil
+
+PIPELINE_FRACTION = 0.5 # Доля свободной памяти под конвейер по умолчанию
+INFERENCE_SHARE = 0.5 # Доля заданного пользователем бюджета под тайлы нейросети на CPU (на GPU тайлы живут в видеопамяти)
+MAX_QUEUE_DEPTH = 5
+
+class MemoryGovernor:
+    """
+    Единый бюджет памяти для конвейера. По размеру кадра и масштабу выводит глубину очередей,
+    число обработчиков и долю памяти под тайлы нейросети, а во время работы придерживает производителей
+    (чтение следующих файлов), пока учтённые буферы не освободят место.
+    """
+    def __init__(self, budget:int|None = None, limit_tiles:bool|None = None):
+        """
+        - budget: бюджет в байтах. None - PIPELINE_FRACTION свободной памяти.
+        - limit_tiles: укладывать в бюджет и тайлы нейросети на CPU. None - только если бюджет задан явно:
+          без него Upscaler сам подбирает тайл по свободной памяти, и бюджет покрывает только буферы кадров.
+        """
+        self.budget = budget or int(psutil.virtual_memory().available * PIPELINE_FRACTION)
+        self.limit_tiles = budget is not None if limit_tiles is None else limit_tiles
+        self.used = 0
+        self.condition = threading.Condition()
+    
+    def reserve(self, size:int, stop_event=None) -> bool:
+        """
+        Учитывает size байт, дождавшись, пока они поместятся в бюджет. Если ничего не учтено, резерв проходит сразу,
+        даже больше бюджета: иначе элемент крупнее бюджета не прошёл бы никогда.
+        Возвращает False, если ожидание прервано stop_event.
+        """
+        with self.condition:
+            while self.used > 0 and self.used + size > self.budget:
+                if stop_event is not None and stop_event.is_set():
+                    return False
+                self.condition.wait(0.1)
+            self.used += size
+            return True
+    
+    def release(self, size:int):
+        with self.condition:
+            self.used = max(0, self.used - size)
+            self.condition.notify_all()
+    
+    def plan_video(self, width:int, height:int, scale:int, workers:int, provider:str, tile_reuse:bool = True) -> dict:
+        """
+        Подбирает параметры конвейера видео под бюджет. Возвращает словарь:
+        read_queue, write_queue (глубины очередей), workers (обработчики кадров),
+        inference (предел байт на тайлы нейросети одного обработчика, 0 - без предела: тайлы в видеопамяти
+        или бюджет не ограничивает тайлы, см. limit_tiles).
+        Сначала уменьшается очередь записи (выходные кадры в scale^2 раз больше входных), потом число обработчиков.
+        """
+        frame_in = width * height * 3
+        frame_out = frame_in * scale * scale
+        inference = int(self.budget * INFERENCE_SHARE) if provider == 'CPUExecutionProvider' and self.limit_tiles else 0
+        buffers = self.budget - inference
+        
+        # Рабочие копии обработчика: RGB вход и вход с отступами, кэш повторного использования тайлов
+        per_worker = frame_in * 2 + (frame_in + frame_out if tile_reuse else 0)
+        
+        def required(read_depth, write_depth, count):
+            # Слоты колец кадров: очередь, обработчики и запас (см. VideoUpscaleWorker.process_video)
+            return count * per_worker + (read_depth + count + 2) * frame_in + (write_depth + count + 2) * frame_out
+        
+        plan = None
+        for count in range(max(1, workers), 0, -1):
+            for write_depth in range(MAX_QUEUE_DEPTH, 0, -1):
+                if required(MAX_QUEUE_DEPTH, write_depth, count) <= buffers:
+                    plan = {'read_queue': MAX_QUEUE_DEPTH, 'write_queue': write_depth, 'workers': count}
+                    break
+            if plan:
+                break
+        
+        if plan is None:
+            # Минимальный конвейер забирает недостающее у тайлов: без буферов кадров обработка невозможна вовсе
+            plan = {'read_queue': 1, 'write_queue': 1, 'workers': 1}
+            if inference:
+                inference = max(0, min(inference, self.budget - required(1, 1, 1)))
+            if required(1, 1, 1) + inference > self.budget:
+                logging.warning(f'Video frames do not fit the memory budget of {self.budget / 1024**3:.2f} GB, using minimal queues')
+        
+        plan['inference'] = inference // plan['workers']
+        logging.info(f'Memory budget {self.budget / 1024**3:.2f} GB: queues {plan["read_queue"]}/{plan["write_queue"]}, '
+                     f'workers {plan["workers"]}, '
+                     f'buffers {required(plan["read_queue"], plan["write_queue"], plan["workers"]) / 1024**3:.2f} GB')
+        return plan
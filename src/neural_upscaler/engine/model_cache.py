@@ -0,0 +1,133 @@
+import os
+import glob
+import hashlib
+import logging
+import onnxruntime as ort
+from neural_upscaler.utils.system import get_machine_fingerprint
+
+PROVIDER_NAMES = {
+    'CUDAExecutionProvider': 'cuda',
+    'DmlExecutionProvider': 'dml',
+    'CPUExecutionProvider': 'cpu',
+}
+
+_hash_cache = {}
+
+def hash_file(path:str) -> str:
+    """
+    Возвращает sha256 файла. Результат запоминается по (путь, размер, время изменения).
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    
+    if key not in _hash_cache:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(block)
+        _hash_cache[key] = digest.hexdigest()
+    
+    return _hash_cache[key]
+
+def get_optimized_model_path(cache_dir:str, model_path:str, providers:list, level) -> str:
+    """
+    Путь к оптимизированному графу в кэше.
+    Имя содержит хэш от исходной модели, версии ONNX Runtime, провайдеров и уровня оптимизации,
+    поэтому при изменении любого из них используется новый файл. Полная оптимизация может зависеть
+    от процессора, поэтому в ключ входит и отпечаток машины.
+    """
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    provider_tag = '-'.join(PROVIDER_NAMES.get(p, p) for p in providers)
+    
+    key = '|'.join([hash_file(model_path), ort.__version__, ','.join(providers), str(int(level)), get_machine_fingerprint()])
+    key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    
+    return os.path.join(cache_dir, f'{stem}.{provider_tag}.{int(level)}.{key_hash}.onnx')
+
+def get_marker_path(cached_path:str) -> str:
+    """
+    Путь к отметке о том, что граф с этим ключом сохранить в кэш не удалось.
+    """
+    return f'{os.path.splitext(cached_path)[0]}.nocache'
+
+def remove_stale(cached_path:str):
+    """
+    Удаляет устаревшие варианты того же графа (с тем же провайдером и уровнем, но другим ключом) и их отметки.
+    """
+    prefix = cached_path.rsplit('.', 2)[0]
+    current = (cached_path, get_marker_path(cached_path))
+    for path in glob.glob(f'{glob.escape(prefix)}.*.onnx') + glob.glob(f'{glob.escape(prefix)}.*.nocache'):
+        if path not in current and not path.endswith('.tmp.onnx'):
+            try:
+                os.remove(path)
+                logging.info(f'Removed stale optimized model: {os.path.basename(path)}')
+            except OSError:
+                pass
+
+def create_cached_session(model_path:str, options:ort.SessionOptions, providers:list, cache_dir:str|None) -> ort.InferenceSession:
+    """
+    Создаёт сессию, используя кэш оптимизированных графов.
+    Если граф уже оптимизирован, он загружается с выключенной оптимизацией.
+    Иначе сессия создаётся из исходной модели, а результат оптимизации сохраняется в кэш.
+    Если сохранить граф не удалось (например, провайдер не умеет его сериализовать), рядом остаётся отметка,
+    и следующие запуски сразу создают сессию без сохранения, не пересоздавая её дважды.
+    - cache_dir: папка кэша. None - кэш не используется.
+    """
+    if not cache_dir:
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    level = options.graph_optimization_level
+    cached_path = get_optimized_model_path(cache_dir, model_path, providers, level)
+    
+    if os.path.exists(cached_path):
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        try:
+            session = ort.InferenceSession(cached_path, sess_options=options, providers=providers)
+            logging.info(f'Loaded pre-optimized model: {os.path.basename(cached_path)}')
+            return session
+        except Exception as e:
+            logging.warning(f'Failed to load cached model, rebuilding: {e}')
+            try:
+                os.remove(cached_path)
+            except OSError:
+                pass # Файл уже удалил или заменил другой процесс
+        options.graph_optimization_level = level
+    
+    marker_path = get_marker_path(cached_path)
+    if os.path.exists(marker_path):
+        return ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    
+    # Сначала пишем во временный файл, чтобы прерванная запись не оставила битый кэш
+    temp_path = f'{os.path.splitext(cached_path)[0]}.{os.getpid()}.tmp.onnx'
+    options.optimized_model_filepath = temp_path
+    try:
+        session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+    except Exception as e:
+        logging.warning(f'Failed to save optimized model, loading without cache: {e}')
+        options.optimized_model_filepath = ''
+        session = ort.InferenceSession(model_path, sess_options=options, providers=providers)
+        mark_not_cacheable(marker_path, temp_path)
+        return session
+    
+    if os.path.exists(temp_path):
+        os.replace(temp_path, cached_path)
+        remove_stale(cached_path)
+        logging.info(f'Saved optimized model to cache: {os.path.basename(cached_path)}')
+    else:
+        mark_not_cacheable(marker_path, temp_path)
+    
+    return session
+
+def mark_not_cacheable(marker_path:str, temp_path:str):
+    """
+    Запоминает, что граф с этим ключом не сохраняется, и убирает недописанный временный файл.
+    Отметка пишется только после того, как сессия без сохранения создалась: ошибка самой модели кэшем не считается.
+    """
+    try:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        open(marker_path, 'w').close()
+        logging.info(f'Optimized model cannot be cached, skipping next time: {os.path.basename(marker_path)}')
+    except OSError:
+        pass
@@ -0,0 +1,71 @@
+import os
+import json
+import logging
+
+MANIFEST_NAME = 'manifest.json'
+
+# Порядок предпочтения точности, если для провайдера нет замеров скорости
+PRECISION_PREFERENCE = {
+    'CPUExecutionProvider': ['fp32', 'fp16'],
+    'CUDAExecutionProvider': ['fp16', 'fp32'],
+    'DmlExecutionProvider': ['fp16', 'fp32'],
+}
+
+def load_manifest(weights_dir:str) -> list:
+    """
+    Читает манифест моделей из папки с весами.
+    Возвращает список вариантов, в каждый добавлен абсолютный путь к файлу ('path').
+    """
+    manifest_path = os.path.join(weights_dir, MANIFEST_NAME)
+    with open(manifest_path, 'r') as file:
+        manifest = json.load(file)
+    
+    variants = []
+    for variant in manifest['models']:
+        variant = dict(variant, path=os.path.join(weights_dir, variant['file']))
+        variants.append(variant)
+    return variants
+
+def is_valid_for(variant:dict, provider:str, quality:str) -> bool:
+    """
+    INT8 модели имеют смысл только на CPU и только в быстром режиме.
+    """
+    if variant['precision'] == 'int8':
+        return provider == 'CPUExecutionProvider' and quality == 'fast'
+    return True
+
+def resolve_variant(variants:list, scale:int, provider:str, quality:str = 'max') -> dict:
+    """
+    Выбирает самый быстрый вариант модели с данным масштабом, пригодный для провайдера.
+    Если есть замеры скорости для провайдера, решают они, иначе - порядок предпочтения точности.
+    - quality: 'max' или 'fast' (разрешает INT8 на CPU).
+    """
+    candidates = [
+        v for v in variants
+        if v['scale'] == scale and os.path.exists(v['path']) and is_valid_for(v, provider, quality)
+    ]
+    if not candidates:
+        raise FileNotFoundError(f'No model x{scale} available for {provider}')
+    
+    measured = [v for v in candidates if v.get('throughput', {}).get(provider)]
+    if measured:
+        return max(measured, key=lambda v: v['throughput'][provider])
+    
+    preference = PRECISION_PREFERENCE.get(provider, ['fp32', 'fp16'])
+    if quality == 'fast':
+        preference = ['int8'] + preference
+    
+    def rank(variant):
+        precision = variant['precision']
+        return preference.index(precision) if precision in preference else len(preference)
+    
+    return min(candidates, key=rank)
+
+def resolve_model(weights_dir:str, model_choice:str, provider:str, quality:str = 'max') -> dict:
+    """
+    Возвращает вариант модели по выбору в интерфейсе ('x2', 'x4').
+    """
+    scale = int(model_choice.lstrip('x'))
+    variant = resolve_variant(load_manifest(weights_dir), scale, provider, quality)
+    logging.info(f'Model {model_choice} on {provider}: {variant["file"]} ({variant["precision"]})')
+    return variant
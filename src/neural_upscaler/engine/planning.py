@@ -0,0 +1,95 @@
+import math
+import cv2
+import numpy as np
+
+# Умножений-сложений на пиксель входа. x2 модель делает pixel_unshuffle и работает на четверти пикселей,
+# поэтому при том же входе она примерно в 4 раза дешевле x4
+MACS_PER_PIXEL = {2: 4.5e6, 4: 17.9e6}
+MAX_POST_UPSCALE = 1.25 # Во сколько раз результат нейросети можно дотянуть интерполяцией до целевого размера
+COST_TOLERANCE = 1.1 # Пути, дороже самого дешёвого не больше чем во столько раз, считаются равными по стоимости
+
+# Целевые размеры задают меньшую сторону результата
+TARGET_SIZES = {'1080p': 1080, '1440p': 1440, '4K': 2160}
+
+def get_target_size(width:int, height:int, target:int) -> tuple:
+    """
+    Размер результата (ширина, высота), у которого меньшая сторона равна target, с сохранением пропорций.
+    Стороны чётные: этого требует yuv420p у видео.
+    """
+    factor = target / min(width, height)
+    return (max(2, round(width * factor / 2) * 2), max(2, round(height * factor / 2) * 2))
+
+def get_model_costs(variants:dict, provider:str) -> dict:
+    """
+    Стоимость пикселя входа для каждого масштаба: {масштаб: (умножения-сложения, секунды или None)}.
+    Секунды берутся из замеров скорости в манифесте (мегапикселей входа в секунду), если они есть для провайдера.
+    - variants: выбранные варианты моделей {масштаб: вариант из манифеста}.
+    """
+    costs = {}
+    for scale, variant in variants.items():
+        throughput = variant.get('throughput', {}).get(provider)
+        macs = MACS_PER_PIXEL.get(scale, MACS_PER_PIXEL[4] * scale ** 2 / 16)
+        costs[scale] = (macs, 1 / (throughput * 1e6) if throughput else None)
+    return costs
+
+def plan_for_scale(width:int, height:int, size:tuple, scale:int, cost:tuple|None = None) -> dict:
+    """
+    Путь к размеру size (ширина, высота) моделью с данным масштабом.
+    Если модель увеличивает больше, чем нужно, вход заранее уменьшается так, чтобы модель попала в size:
+    это дешевле, чем увеличить вход целиком и потом уменьшить результат. Остаток (меньше масштаба в пикселях
+    или дотягивание интерполяцией, если модель увеличивает меньше нужного) закрывает resize результата.
+    Возвращает словарь: scale, input (размер входа модели), output (size), post_upscale (во сколько раз
+    результат модели растягивается интерполяцией), macs и seconds (оценка стоимости, None - нет замеров).
+    """
+    target_w, target_h = size
+    input_w = max(1, min(width, round(target_w / scale)))
+    input_h = max(1, min(height, round(target_h / scale)))
+    
+    macs, seconds = cost or (MACS_PER_PIXEL.get(scale, 0), None)
+    pixels = input_w * input_h
+    return {
+        'scale': scale,
+        'input': (input_w, input_h),
+        'output': (target_w, target_h),
+        'post_upscale': max(target_w / (input_w * scale), target_h / (input_h * scale)),
+        'macs': pixels * macs,
+        'seconds': pixels * seconds if seconds is not None else None,
+    }
+
+def plan_target(width:int, height:int, size:tuple, costs:dict) -> dict:
+    """
+    Выбирает самый дешёвый путь к размеру size среди доступных моделей.
+    Пути, где результат пришлось бы растягивать больше MAX_POST_UPSCALE, отбрасываются (страдает качество),
+    если таких нет - берётся модель с наибольшим масштабом. Стоимость сравнивается по замерам скорости,
+    если они есть для всех моделей, иначе по числу операций. Из равных по стоимости путей выбирается тот,
+    что меньше уменьшает вход: x4 на уменьшенном вдвое кадре стоит столько же, сколько x2 на целом, но теряет детали.
+    - costs: {масштаб: стоимость пикселя входа} (см. get_model_costs).
+    """
+    plans = [plan_for_scale(width, height, size, scale, cost) for scale, cost in costs.items()]
+    suitable = [plan for plan in plans if plan['post_upscale'] <= MAX_POST_UPSCALE]
+    if not suitable:
+        return max(plans, key=lambda plan: plan['scale'])
+    
+    measure = 'seconds' if all(plan['seconds'] is not None for plan in suitable) else 'macs'
+    cheapest = min(plan[measure] for plan in suitable)
+    cheap = [plan for plan in suitable if plan[measure] <= cheapest * COST_TOLERANCE]
+    return max(cheap, key=lambda plan: (plan['input'][0] * plan['input'][1], -plan[measure]))
+
+def resize_image(img:np.ndarray, size:tuple) -> np.ndarray:
+    """
+    Приводит изображение к размеру size (ширина, высота). Уменьшение - INTER_AREA, увеличение - INTER_CUBIC.
+    """
+    h, w = img.shape[:2]
+    if (w, h) == tuple(size):
+        return img
+    interpolation = cv2.INTER_AREA if size[0] * size[1] < w * h else cv2.INTER_CUBIC
+    return cv2.resize(img, tuple(size), interpolation=interpolation)
+
+def format_cost(plan:dict, count:int = 1) -> str:
+    """
+    Оценка стоимости для лога: время, если есть замеры, иначе операции (TMAC).
+    - count: сколько раз план выполняется (кадры видео).
+    """
+    if plan['seconds'] is not None:
+        return f'~{math.ceil(plan["seconds"] * count)} s'
+    return f'{plan["macs"] * count / 1e12:.1f} TMAC'
@@ -0,0 +1,364 @@
+import os
+import time
+import json
+import shutil
+import hashlib
+import logging
+import threading
+import multiprocessing
+import concurrent.futures
+from neural_upscaler.engine.ffmpeg_wrapper import probe_video, probe_keyframes, concat_segments
+from neural_upscaler.engine.video_processor import VideoUpscaleWorker, EncoderTuner, get_encoder_threads
+from neural_upscaler.engine.model_cache import hash_file
+from neural_upscaler.engine.memory import MemoryGovernor
+from neural_upscaler.utils.system import get_cpu_threads
+
+MIN_SEGMENT_SECONDS = 30 # Короче этого части не делаются: запуск процесса и модели не окупится
+MAX_SEGMENT_SECONDS = 300 # Части не длиннее, чтобы при возобновлении терялось не больше нескольких минут работы
+SEGMENTS_PER_WORKER = 4 # Частей больше, чем процессов, чтобы процессы заканчивали примерно одновременно
+MAX_RETRIES = 1
+MANIFEST_NAME = 'job.json'
+
+def plan_segments(keyframes:list, meta:dict, workers:int) -> list:
+    """
+    Делит видео на части по ключевым кадрам, примерно равные по числу кадров.
+    Возвращает список {'index', 'start' (секунды для -ss), 'first_frame', 'frames'}.
+    """
+    fps = float(meta['fps'])
+    total_frames = meta['frames']
+    target = min(total_frames / (workers * SEGMENTS_PER_WORKER), MAX_SEGMENT_SECONDS * fps)
+    target = max(MIN_SEGMENT_SECONDS * fps, target)
+    
+    # Позиция чуть раньше ключевого кадра: FFmpeg перейдёт к нему и не отбросит его из-за округления времени
+    def to_start(time):
+        return max(0.0, time - meta['start_time'] - 0.5 / fps)
+    
+    # Первая часть всегда начинается с начала файла: если поток начинается не с ключевого кадра (открытый GOP,
+    # обрезанный исходник), кадры до первого ключевого иначе не попали бы ни в одну часть
+    bounds = [(meta['start_time'], 0)]
+    for time, frame in keyframes:
+        if frame - bounds[-1][1] >= target and total_frames - frame >= target / 2:
+            bounds.append((time, frame))
+    
+    segments = []
+    for index, (time, frame) in enumerate(bounds):
+        end = bounds[index + 1][1] if index + 1 < len(bounds) else total_frames
+        segments.append({'index': index, 'start': to_start(time), 'first_frame': frame, 'frames': end - frame})
+    return segments
+
+def get_job_key(input_path:str, settings:dict, target_size:int|None = None) -> str:
+    """
+    Ключ задания: исходный файл (путь, размер, время изменения), модель и влияющие на результат настройки,
+    включая целевой размер.
+    Тот же файл с той же моделью и настройками попадает в ту же папку задания.
+    """
+    stat = os.stat(input_path)
+    key = '|'.join([os.path.abspath(input_path), str(stat.st_size), str(stat.st_mtime_ns), hash_file(settings['model_path']),
+                    str(settings['scale']), str(settings['tile_align']), str(settings['flat_threshold']), str(target_size)])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+def load_manifest(job_dir:str, key:str) -> dict|None:
+    path = os.path.join(job_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'r') as file:
+            manifest = json.load(file)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Failed to read video job manifest, starting over: {e}')
+        return None
+    return manifest if manifest.get('key') == key else None
+
+def save_manifest(job_dir:str, manifest:dict):
+    # Сначала во временный файл: прерванная запись не должна испортить уже сохранённые контрольные точки
+    path = os.path.join(job_dir, MANIFEST_NAME)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file, indent=4)
+    os.replace(temp_path, path)
+
+def get_segment_path(job_dir:str, segment:dict) -> str:
+    return os.path.join(job_dir, f'segment_{segment["index"]:05d}.mp4')
+
+def encode_segment(worker:VideoUpscaleWorker, input_path:str, output_path:str, meta:dict, segment:dict, work_dir:str, progress) -> bool:
+    """
+    Увеличивает одну часть видео. Файл части появляется под своим именем только целиком:
+    незаконченная часть остаётся во временном файле и при возобновлении обрабатывается заново.
+    """
+    temp_path = f'{os.path.splitext(output_path)[0]}.part.mp4'
+    if not worker.process_video(input_path, temp_path, work_dir, progress, meta=meta, segment=segment):
+        return False
+    os.replace(temp_path, output_path)
+    return True
+
+# Состояние процесса-обработчика: модель загружается один раз на процесс
+_worker_state = {}
+
+def init_worker(settings:dict, encoder:tuple, memory_budget:int, limit_tiles:bool, target_size:int|None, cancel_event, progress_queue):
+    """
+    - encoder: (самый быстрый пресет, самый медленный пресет, потоки) для подбора настроек энкодера в процессе.
+    - memory_budget: доля общего бюджета памяти на процесс.
+    - limit_tiles: укладывать ли в бюджет тайлы нейросети (см. MemoryGovernor).
+    - target_size: меньшая сторона результата (см. VideoUpscaleWorker).
+    """
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s: %(module)s - %(message)s', datefmt='%H:%M:%S')
+    _worker_state.update(settings=settings, cancel_event=cancel_event, progress_queue=progress_queue, upscaler=None,
+                         encoder_tuner=EncoderTuner(*encoder), governor=MemoryGovernor(memory_budget, limit_tiles),
+                         target_size=target_size)
+    threading.Thread(target=watch_cancel, args=(cancel_event,), daemon=True).start()
+
+def watch_cancel(cancel_event):
+    """
+    Прерывает идущий кадр процесса-обработчика сразу после отмены, не дожидаясь конца тайла (см. Upscaler.cancel).
+    """
+    try:
+        cancel_event.wait()
+    except (EOFError, OSError):
+        return # Менеджер уже остановлен вместе с пулом
+    if _worker_state['upscaler'] is not None:
+        _worker_state['upscaler'].cancel()
+
+def process_segment(input_path:str, output_path:str, meta:dict, segment:dict, work_dir:str) -> str:
+    """
+    Увеличивает одну часть видео в процессе-обработчике. Прогресс отправляется в общую очередь как (номер части, процент).
+    """
+    from neural_upscaler.engine.upscaler import Upscaler
+    
+    # Пул передаёт процессам задачи заранее, и такую задачу уже нельзя отменить из основного процесса
+    if _worker_state['cancel_event'].is_set():
+        raise InterruptedError('Stopped by user.')
+    
+    if _worker_state['upscaler'] is None:
+        _worker_state['upscaler'] = Upscaler(**_worker_state['settings'])
+    
+    cancel_event = _worker_state['cancel_event']
+    progress_queue = _worker_state['progress_queue']
+    
+    def progress(percent):
+        progress_queue.put((segment['index'], percent))
+        return not cancel_event.is_set()
+    
+    worker = VideoUpscaleWorker(_worker_state['upscaler'], encoder_tuner=_worker_state['encoder_tuner'], governor=_worker_state['governor'],
+                                target_size=_worker_state['target_size'])
+    if not encode_segment(worker, input_path, output_path, meta, segment, work_dir, progress):
+        if cancel_event.is_set():
+            raise InterruptedError('Stopped by user.')
+        raise RuntimeError(f'Segment {segment["index"]} failed')
+    return output_path
+
+class SegmentedVideoWorker:
+    """
+    Обработка видео частями. Видео делится по ключевым кадрам, каждая часть увеличивается и кодируется отдельно
+    (при processes > 1 - в своём процессе со своим x264), затем части склеиваются без перекодирования,
+    а звук из исходника добавляется один раз.
+    Если задан jobs_dir, готовые части и манифест задания сохраняются там, и повторный запуск того же файла
+    с той же моделью продолжает с последней готовой части.
+    Интерфейс как у VideoUpscaleWorker: process_video и stop_event.
+    """
+    def __init__(self, upscaler, processes:int = 1, workers:int = 1, jobs_dir:str|None = None, encoder_tuner:EncoderTuner|None = None,
+                 governor:MemoryGovernor|None = None, target_size:int|None = None):
+        """
+        - processes: количество процессов. 1 - части обрабатываются по очереди в текущем процессе.
+        - workers: потоки обработки кадров при processes = 1 (см. VideoUpscaleWorker).
+        - jobs_dir: папка для возобновляемых заданий. None - части удаляются и после остановки.
+        - encoder_tuner: подбор настроек энкодера между частями (см. EncoderTuner). В каждом процессе пула свой,
+          с теми же границами пресетов и долей потоков.
+        - governor: бюджет памяти (см. MemoryGovernor). Процессы пула делят его поровну.
+        - target_size: меньшая сторона результата (см. VideoUpscaleWorker).
+        """
+        self.upscaler = upscaler
+        self.processes = max(1, processes)
+        self.workers = workers
+        self.jobs_dir = jobs_dir
+        self.encoder_tuner = encoder_tuner
+        self.governor = governor or MemoryGovernor()
+        self.target_size = target_size
+        self.fps = 0.0 # Кадры в секунду по всем частям с начала запуска
+        self.stop_event = threading.Event()
+    
+    def process_video(self, input_path, output_path, work_dir, progress=None, meta=None):
+        """
+        - meta: параметры видео от probe_video, если уже известны. Кадры не обязательно считать заранее:
+          точное число берётся из того же прохода ffprobe, что и ключевые кадры.
+        """
+        self.stop_event.clear()
+        
+        meta = meta or probe_video(input_path, count_frames=False)
+        if self.jobs_dir:
+            key = get_job_key(input_path, self.upscaler.settings, self.target_size)
+            job_dir = os.path.join(self.jobs_dir, key)
+            manifest = load_manifest(job_dir, key)
+        else:
+            key = None
+            job_dir = os.path.join(work_dir, f'segments_{os.getpid()}')
+            manifest = None
+        
+        if manifest is None:
+            keyframes, frames = probe_keyframes(input_path) if meta else (None, 0)
+            if keyframes is not None:
+                meta = dict(meta, frames=frames)
+            segments = plan_segments(keyframes, meta, self.processes) if keyframes else []
+            manifest = {'key': key, 'input': os.path.abspath(input_path), 'segments': segments, 'completed': []}
+        elif meta:
+            meta = dict(meta, frames=sum(segment['frames'] for segment in manifest['segments']))
+        
+        if not meta or len(manifest['segments']) < 2:
+            logging.info('Video is too short or cannot be split, using single pipeline')
+            pipeline = VideoUpscaleWorker(self.upscaler, workers=self.workers, encoder_tuner=self.encoder_tuner, governor=self.governor,
+                                          target_size=self.target_size)
+            pipeline.stop_event = self.stop_event
+            
+            def pipeline_progress(percent):
+                self.fps = pipeline.fps
+                return progress(percent) if progress else True
+            
+            return pipeline.process_video(input_path, output_path, work_dir, pipeline_progress, meta=meta)
+        
+        os.makedirs(job_dir, exist_ok=True)
+        save_manifest(job_dir, manifest)
+        
+        # Часть считается готовой, только если она есть и в манифесте, и на диске
+        completed = {index for index in manifest['completed'] if os.path.exists(get_segment_path(job_dir, manifest['segments'][index]))}
+        if completed:
+            logging.info(f'Resuming video job {key}: {len(completed)} of {len(manifest["segments"])} segments done')
+        
+        finished = False
+        try:
+            finished = self.run_segments(input_path, job_dir, meta, manifest, completed, progress)
+            if finished:
+                finished = self.join_segments(input_path, output_path, job_dir, manifest['segments'])
+            return finished
+        finally:
+            if finished or not self.jobs_dir:
+                shutil.rmtree(job_dir, ignore_errors=True)
+    
+    def run_segments(self, input_path, job_dir, meta, manifest, completed, progress) -> bool:
+        segments = manifest['segments']
+        pending = [segment for segment in segments if segment['index'] not in completed]
+        done_frames = {segment['index']: segment['frames'] if segment['index'] in completed else 0 for segment in segments}
+        resumed_frames = sum(done_frames.values())
+        started = time.perf_counter()
+        self.fps = 0.0
+        
+        def on_completed(segment):
+            completed.add(segment['index'])
+            done_frames[segment['index']] = segment['frames']
+            manifest['completed'] = sorted(completed)
+            save_manifest(job_dir, manifest)
+        
+        def report():
+            self.fps = max(0.0, sum(done_frames.values()) - resumed_frames) / (time.perf_counter() - started)
+            return not progress or progress(int(sum(done_frames.values()) / meta['frames'] * 100)) is not False
+        
+        if not pending:
+            return True
+        
+        logging.info(f'Segmented video: {len(pending)} segments to process, {self.processes} processes')
+        if self.processes == 1:
+            return self.run_in_process(input_path, job_dir, meta, pending, done_frames, on_completed, report)
+        return self.run_in_pool(input_path, job_dir, meta, pending, done_frames, on_completed, report)
+    
+    def run_in_process(self, input_path, job_dir, meta, pending, done_frames, on_completed, report) -> bool:
+        """
+        Обрабатывает части по очереди в текущем процессе общей моделью.
+        """
+        tuner = self.encoder_tuner or EncoderTuner(threads=get_encoder_threads(self.upscaler))
+        for segment in pending:
+            def segment_progress(percent):
+                done_frames[segment['index']] = segment['frames'] * percent // 100
+                return report()
+            
+            worker = VideoUpscaleWorker(self.upscaler, workers=self.workers, encoder_tuner=tuner, governor=self.governor,
+                                        target_size=self.target_size)
+            worker.stop_event = self.stop_event
+            if not encode_segment(worker, input_path, get_segment_path(job_dir, segment), meta, segment, job_dir, segment_progress):
+                return False
+            on_completed(segment)
+        return True
+    
+    def run_in_pool(self, input_path, job_dir, meta, pending, done_frames, on_completed, report) -> bool:
+        """
+        Обрабатывает части в пуле процессов, у каждого процесса своя модель и свои потоки CPU.
+        """
+        physical, _ = get_cpu_threads()
+        # Ядра делятся между процессами пула, а внутри процесса - между его параллельными сессиями
+        sessions = max(1, self.upscaler.settings['parallel_sessions'])
+        settings = dict(self.upscaler.settings, threads_per_session=max(1, physical // (self.processes * sessions)))
+        tuner = self.encoder_tuner or EncoderTuner(threads=get_encoder_threads(self.upscaler))
+        encoder = (tuner.presets[0], tuner.presets[-1], max(1, tuner.threads // self.processes) if tuner.threads else 0)
+        
+        context = multiprocessing.get_context('spawn')
+        manager = context.Manager()
+        cancel_event = manager.Event()
+        progress_queue = manager.Queue()
+        attempts = {segment['index']: 0 for segment in pending}
+        frames = {segment['index']: segment['frames'] for segment in pending}
+        
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.processes, mp_context=context,
+                                                      initializer=init_worker, initargs=(settings, encoder, self.governor.budget // self.processes, self.governor.limit_tiles, self.target_size,
+                                                                cancel_event, progress_queue))
+        
+        def submit(segment):
+            return pool.submit(process_segment, input_path, get_segment_path(job_dir, segment), meta, segment, job_dir)
+        
+        futures = {}
+        try:
+            futures.update({submit(segment): segment for segment in pending})
+            
+            while futures:
+                if self.stop_event.is_set():
+                    cancel_event.set()
+                    for future in futures:
+                        future.cancel() # Ещё не начатые части не запускаются
+                    logging.info('Video processing was stopped by user.')
+                    return False
+                
+                done, _ = concurrent.futures.wait(futures, timeout=0.2, return_when=concurrent.futures.FIRST_COMPLETED)
+                
+                while not progress_queue.empty():
+                    index, percent = progress_queue.get()
+                    done_frames[index] = frames[index] * percent // 100
+                
+                for future in done:
+                    segment = futures.pop(future)
+                    try:
+                        future.result()
+                        on_completed(segment)
+                    except Exception as e:
+                        attempts[segment['index']] += 1
+                        if attempts[segment['index']] > MAX_RETRIES:
+                            raise RuntimeError(f'Segment {segment["index"]} failed: {e}')
+                        logging.warning(f'Segment {segment["index"]} failed, retrying: {e}')
+                        done_frames[segment['index']] = 0
+                        futures[submit(segment)] = segment
+                
+                if not report():
+                    self.stop_event.set()
+        except BaseException:
+            cancel_event.set()
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            manager.shutdown()
+            
+            # Части, которые успели закончиться во время остановки, тоже сохраняются как готовые
+            for future, segment in futures.items():
+                if future.done() and not future.cancelled() and future.exception() is None:
+                    on_completed(segment)
+        return True
+    
+    def join_segments(self, input_path, output_path, job_dir, segments) -> bool:
+        list_path = os.path.join(job_dir, 'segments.txt')
+        with open(list_path, 'w', encoding='utf-8') as file:
+            for segment in segments:
+                # Относительные пути concat demuxer считает от папки списка, поэтому пишутся абсолютные
+                path = os.path.abspath(get_segment_path(job_dir, segment)).replace('\\', '/')
+                file.write(f"file '{path}'\n")
+        
+        if not concat_segments(list_path, output_path, audio_source=input_path):
+            return False
+        
+        logging.info('Video processing completed successfully.')
+        return True
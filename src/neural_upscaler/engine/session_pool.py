@@ -0,0 +1,74 @@
+import os
+import threading
+import logging
+import psutil
+from collections import OrderedDict
+
+DEFAULT_MEMORY_CAP = 2 * 1024 ** 3
+
+class SessionPool:
+    """
+    Реестр загруженных сессий ONNX Runtime на весь процесс.
+    Сессии хранятся по ключу (модель, провайдеры, настройки) и вытесняются по LRU,
+    когда их суммарный объём превышает memory_cap.
+    """
+    def __init__(self, memory_cap:int = DEFAULT_MEMORY_CAP):
+        self.memory_cap = memory_cap
+        self.sessions = OrderedDict() # ключ -> (сессия, оценка занимаемой памяти)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+    
+    def get_session(self, key:tuple, model_path:str, create):
+        """
+        Возвращает сессию из реестра или создаёт её через create().
+        Если ту же сессию уже загружает другой поток (например, фоновый прогрев), ждёт его.
+        """
+        with self.lock:
+            if key in self.sessions:
+                self.sessions.move_to_end(key)
+                logging.info(f'Reusing loaded ONNX Runtime session for {os.path.basename(model_path)}')
+                return self.sessions[key][0]
+            key_lock = self.key_locks.setdefault(key, threading.Lock())
+        
+        with key_lock:
+            with self.lock:
+                if key in self.sessions:
+                    self.sessions.move_to_end(key)
+                    return self.sessions[key][0]
+            
+            process = psutil.Process()
+            rss_before = process.memory_info().rss
+            session = create()
+            rss_delta = process.memory_info().rss - rss_before
+            
+            # На GPU веса уходят в видеопамять, поэтому не меньше размера файла модели
+            size = max(rss_delta, os.path.getsize(model_path))
+            
+            with self.lock:
+                self.sessions[key] = (session, size)
+                self.evict(keep=key)
+        
+        return session
+    
+    def evict(self, keep=None):
+        """
+        Выгружает давно не использованные сессии, пока суммарный объём больше лимита.
+        Вызывается под self.lock.
+        """
+        total = sum(size for _, size in self.sessions.values())
+        
+        for key in list(self.sessions):
+            if total <= self.memory_cap:
+                break
+            if key == keep:
+                continue
+            
+            _, size = self.sessions.pop(key)
+            total -= size
+            logging.info(f'Evicted ONNX Runtime session {key[0]} ({size / 1024**2:.0f} MB)')
+    
+    def clear(self):
+        with self.lock:
+            self.sessions.clear()
+
+session_pool = SessionPool()
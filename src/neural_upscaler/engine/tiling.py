@@ -0,0 +1,164 @@
+import math
+import cv2
+import numpy as np
+
+def align_up(value:int, align:int) -> int:
+    return math.ceil(value / align) * align
+
+def plan_axis(length:int, tile_size:int, tile_pad:int, align:int = 1) -> list:
+    """
+    Разбивает одну ось изображения на тайлы. Возвращает список (начало, размер).
+    Количество тайлов минимально (каждый лишний тайл добавляет 2 * tile_pad пикселей),
+    из двух раскладок выбирается та, что выводит меньше лишних пикселей:
+    - равные тайлы, покрывающие ось;
+    - тайлы полного размера и уменьшенный крайний тайл.
+    Равные тайлы предпочитаются, если проигрывают не больше, чем на выравнивание:
+    их можно собрать в одну пачку, и они не порождают отдельных вызовов для узких краёв.
+    """
+    count = math.ceil(length / tile_size)
+    
+    size = align_up(math.ceil(length / count), align)
+    balanced = [(i * size, size) for i in range(count)] if size <= tile_size else None
+    
+    last = align_up(length - (count - 1) * tile_size, align)
+    shrunk = [(i * tile_size, tile_size) for i in range(count - 1)] + [((count - 1) * tile_size, last)]
+    
+    if balanced and sum(s for _, s in balanced) <= sum(s for _, s in shrunk) + count * align:
+        return balanced
+    return shrunk
+
+class TilePlan:
+    """
+    Раскладка тайлов для изображения h x w.
+    - rows, cols: списки (начало, размер) по вертикали и горизонтали.
+    - tile_pad: перекрытие (контекст) с каждой стороны тайла.
+    """
+    def __init__(self, h:int, w:int, rows:list, cols:list, tile_pad:int):
+        self.h = h
+        self.w = w
+        self.rows = rows
+        self.cols = cols
+        self.tile_pad = tile_pad
+        
+        # Площадь, покрытая тайлами (может выходить за границы изображения)
+        self.covered_h = sum(size for _, size in rows)
+        self.covered_w = sum(size for _, size in cols)
+        
+        # Все пиксели, прошедшие через модель, включая перекрытие
+        self.inferred_pixels = sum(size + 2 * tile_pad for _, size in rows) * sum(size + 2 * tile_pad for _, size in cols)
+        self.overhead = self.inferred_pixels / (h * w) - 1
+    
+    def tiles(self) -> list:
+        """
+        Список тайлов (y, x, высота, ширина) в координатах исходного изображения.
+        """
+        return [(y, x, th, tw) for y, th in self.rows for x, tw in self.cols]
+    
+    def __str__(self):
+        return f'{len(self.rows)}x{len(self.cols)} tiles for {self.w}x{self.h}, overhead {self.overhead:.1%}'
+
+def region_sums(table:np.ndarray, tiles:list, tile_pad:int) -> np.ndarray:
+    """
+    Суммы по областям тайлов (с контекстом) из интегрального изображения table.
+    """
+    y0, x0, th, tw = np.array(tiles).T
+    y1 = y0 + th + tile_pad * 2
+    x1 = x0 + tw + tile_pad * 2
+    return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+def tile_deviation(img_padded:np.ndarray, tiles:list, tile_pad:int) -> np.ndarray:
+    """
+    Стандартное отклонение яркости каждого тайла вместе с его контекстом (максимум по каналам).
+    Считается сразу для всех тайлов по интегральным изображениям, без перебора пикселей.
+    - img_padded: изображение с отступами tile_pad, из которого вырезаются тайлы.
+    - tiles: список (y, x, высота, ширина) в координатах исходного изображения.
+    """
+    if not tiles:
+        return np.zeros(0)
+    
+    sums, sq_sums = cv2.integral2(img_padded, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
+    sums = sums.reshape(sums.shape[0], sums.shape[1], -1)
+    sq_sums = sq_sums.reshape(sq_sums.shape[0], sq_sums.shape[1], -1)
+    
+    _, _, th, tw = np.array(tiles).T
+    area = ((th + tile_pad * 2) * (tw + tile_pad * 2))[:, np.newaxis]
+    
+    mean = region_sums(sums, tiles, tile_pad) / area
+    variance = np.maximum(region_sums(sq_sums, tiles, tile_pad) / area - mean ** 2, 0)
+    return np.sqrt(variance).max(axis=1)
+
+class TileReuseCache:
+    """
+    Повторное использование тайлов между соседними кадрами видео.
+    Для каждого тайла хранится его область (с контекстом) из того кадра, по которому он последний раз обработан,
+    и общий предыдущий результат. Тайл, в области которого ни один пиксель не отличается от его опорной области
+    больше чем на pixel_threshold, копируется из предыдущего результата. Опорные области у соседних тайлов
+    перекрываются контекстом, поэтому хранятся отдельно: обработка соседа не меняет опору тайла, взятого из кэша.
+    Раз в refresh_interval кадров обрабатывается весь кадр, чтобы ограничить накопление расхождений.
+    """
+    def __init__(self, refresh_interval:int = 60, pixel_threshold:int = 8):
+        self.refresh_interval = refresh_interval
+        self.pixel_threshold = pixel_threshold
+        self.references = None
+        self.shape = None
+        self.output = None
+        self.tiles = None
+        self.frames_since_refresh = 0
+        
+        self.reused_tiles = 0
+        self.flat_tiles = 0 # Заново обработанные тайлы, увеличенные интерполяцией (считает Upscaler.process_image)
+        self.total_tiles = 0
+    
+    def find_unchanged(self, img_padded:np.ndarray, tiles:list, tile_pad:int) -> np.ndarray:
+        """
+        Возвращает маску тайлов, которые можно взять из предыдущего результата.
+        Если раскладка или размер кадра изменились или пора обновить кадр целиком, маска пустая.
+        """
+        unchanged = np.zeros(len(tiles), dtype=bool)
+        if (self.references is None or self.tiles != tiles or self.shape != img_padded.shape
+                or self.frames_since_refresh >= self.refresh_interval):
+            self.frames_since_refresh = 0
+            return unchanged
+        
+        for index, (y, x, th, tw) in enumerate(tiles):
+            region = img_padded[y:y + th + tile_pad * 2, x:x + tw + tile_pad * 2]
+            unchanged[index] = cv2.absdiff(region, self.references[index]).max() <= self.pixel_threshold
+        self.frames_since_refresh += 1
+        return unchanged
+    
+    def update(self, img_padded:np.ndarray, img_up:np.ndarray, tiles:list, unchanged:np.ndarray, tile_pad:int, scale:int):
+        """
+        Запоминает результат кадра и опорные области заново обработанных тайлов.
+        Результат копируется: img_up может быть слотом FrameRing, который после записи займёт другой кадр.
+        """
+        if (self.references is None or self.tiles != tiles or self.shape != img_padded.shape
+                or self.output.shape != img_up.shape):
+            self.references = [None] * len(tiles)
+            self.output = img_up.copy()
+            copy_output = False
+        else:
+            copy_output = True
+        
+        h, w = img_up.shape[0] // scale, img_up.shape[1] // scale
+        for index, ((y, x, th, tw), reused) in enumerate(zip(tiles, unchanged)):
+            if reused:
+                continue
+            self.references[index] = img_padded[y:y + th + tile_pad * 2, x:x + tw + tile_pad * 2].copy()
+            if copy_output:
+                y0, x0 = y * scale, x * scale
+                y1, x1 = min(y + th, h) * scale, min(x + tw, w) * scale
+                self.output[y0:y1, x0:x1] = img_up[y0:y1, x0:x1]
+        
+        self.tiles = tiles
+        self.shape = img_padded.shape
+        self.reused_tiles += int(unchanged.sum())
+        self.total_tiles += len(tiles)
+
+def plan_tiles(h:int, w:int, tile_size:int, tile_pad:int, align:int = 1) -> TilePlan:
+    """
+    Подбирает раскладку тайлов с минимальным числом выведенных пикселей.
+    Число выведенных пикселей раскладывается в произведение сумм по осям, поэтому оси планируются независимо.
+    """
+    rows = plan_axis(h, tile_size, tile_pad, align)
+    cols = plan_axis(w, tile_size, tile_pad, align)
+    return TilePlan(h, w, rows, cols, tile_pad)
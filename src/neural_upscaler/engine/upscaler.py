@@ -2,38 +2,243 @@ import numpy as np
 import math
 import cv2
 import gc
+import os
+import copy
+import time
+import queue
+import weakref
+import threading
+import concurrent.futures
 import onnxruntime as ort
-from neural_upscaler.utils.system import get_vram_limit
+from neural_upscaler.utils.system import get_vram_limit, get_cpu_threads
+from neural_upscaler.engine.tiling import plan_tiles, plan_axis, align_up, tile_deviation, TileReuseCache
+from neural_upscaler.engine.session_pool import session_pool
+from neural_upscaler.engine.model_cache import create_cached_session
+from neural_upscaler.engine.planning import plan_for_scale, resize_image
 import logging
 
-class Upscaler:
-    def __init__(self, model_path:str, scale:int = 4):
+MAX_BATCH_SIZE = 8
+BATCH_TILE_SIZE = 512 # Предел стороны тайла в режиме пакетной обработки
+MAX_CACHED_SHAPES = 4 # Сколько наборов буферов под разные размеры тайлов держать в памяти
+MIN_TILE_SIZE = 32 # Меньше этого тайлы при нехватке памяти не делятся
+FLAT_TILE_THRESHOLD = 1.0 # Тайлы с отклонением яркости не больше этого (из 255) увеличиваются интерполяцией
+
+EXECUTION_MODES = {
+    'sequential': ort.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': ort.ExecutionMode.ORT_PARALLEL,
+}
+
+def get_providers_list() -> list:
+    """
+    Возвращает список провайдеров ONNX Runtime в порядке приоритета.
+    """
+    availible_providers = ort.get_available_providers()
+    
+    providers_list = []
+    if 'CUDAExecutionProvider' in availible_providers:
+        providers_list.append('CUDAExecutionProvider')
+    if 'DmlExecutionProvider' in availible_providers:
+        providers_list.append('DmlExecutionProvider')
+    providers_list.append('CPUExecutionProvider')
+    
+    return providers_list
+
+def create_session_options(tuning:dict|None = None) -> ort.SessionOptions:
+    """
+    Создаёт настройки сессии. Параметры из tuning (потоки, режим исполнения) переопределяют значения по умолчанию.
+    """
+    tuning = tuning or {}
+    
+    options = ort.SessionOptions()
+    options.enable_mem_pattern = True
+    options.execution_mode = EXECUTION_MODES[tuning.get('execution_mode', 'sequential')]
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = tuning.get('intra_op_threads', 0)
+    options.inter_op_num_threads = tuning.get('inter_op_threads', 0)
+    
+    return options
+
+def get_session_key(model_path:str, providers:list, tuning:dict|None = None, instance:int = 0) -> tuple:
+    """
+    Ключ сессии в реестре: модель, провайдеры и влияющие на сессию настройки.
+    - instance: номер копии сессии, когда одной модели нужно несколько независимых сессий.
+    """
+    tuning = tuning or {}
+    options_key = tuple(tuning.get(name) for name in ('execution_mode', 'intra_op_threads', 'inter_op_threads'))
+    return (os.path.abspath(model_path), tuple(providers), options_key, instance)
+
+def create_session(model_path:str, providers:list, tuning:dict|None = None, cache_dir:str|None = None, instance:int = 0):
+    """
+    Возвращает сессию из реестра, создавая её при необходимости.
+    """
+    try:
+        return session_pool.get_session(
+            get_session_key(model_path, providers, tuning, instance),
+            model_path,
+            lambda: create_cached_session(model_path, create_session_options(tuning), providers, cache_dir)
+        )
+    except Exception as e:
+        logging.error(f'Failed to create ONNX Runtime session: {e}')
+        raise RuntimeError(f'Failed to create ONNX Runtime session: {e}')
+
+class TileRunner:
+    """
+    Сессия ONNX Runtime вместе со своим IOBinding и буферами.
+    Один раннер в каждый момент времени используется только одним потоком.
+    """
+    def __init__(self, session, scale:int):
+        self.session = session
         self.scale = scale
         
-        options = ort.SessionOptions()
-        options.enable_mem_pattern = True
-        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
-        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        model_input = session.get_inputs()[0]
+        model_output = session.get_outputs()[0]
+        
+        self.input_name = model_input.name
+        self.output_name = model_output.name
+        self.input_dtype = np.float16 if 'float16' in model_input.type else np.float32
+        self.output_dtype = np.float16 if 'float16' in model_output.type else np.float32
+        
+        # Буферы под IOBinding переиспользуются между вызовами, ключ - форма пачки тайлов
+        self.binding = session.io_binding()
+        self.buffers = {}
+        
+        # Флаг terminate прерывает уже идущий вызов сессии (см. Upscaler.cancel)
+        self.run_options = ort.RunOptions()
+    
+    def get_buffers(self, n:int, h:int, w:int) -> tuple:
+        """
+        Возвращает предвыделенные буферы (вход модели, выход модели, результат uint8) для пачки тайлов.
+        """
+        key = (n, h, w)
+        buffers = self.buffers.pop(key, None)
+        
+        if buffers is None:
+            if len(self.buffers) >= MAX_CACHED_SHAPES:
+                self.buffers.pop(next(iter(self.buffers)))
+                
+            out_h, out_w = h * self.scale, w * self.scale
+            buffers = (
+                np.empty((n, 3, h, w), dtype=self.input_dtype),
+                np.empty((n, 3, out_h, out_w), dtype=self.output_dtype),
+                np.empty((n, out_h, out_w, 3), dtype=np.uint8)
+            )
         
-        availible_providers = ort.get_available_providers()
-        logging.info(f'Available ONNX Runtime providers: {availible_providers}')
+        self.buffers[key] = buffers # Последний использованный набор уходит в конец очереди вытеснения
+        return buffers
+    
+    def run(self, patches:list) -> np.ndarray:
+        """
+        Прогоняет пачку кусков одинакового размера через модель за один вызов.
+        Возвращает массив (N, H*scale, W*scale, 3) в BGR формате. Массив является внутренним буфером
+        и перезаписывается следующим вызовом с той же формой.
+        - patches: входные куски (H, W, 3) в формате RGB (uint8).
+        """
+        h, w, _ = patches[0].shape
+        img_blob, output, result = self.get_buffers(len(patches), h, w)
         
-        providers_list = []
-        if 'CUDAExecutionProvider' in availible_providers:
-            providers_list.append('CUDAExecutionProvider')
-        if 'DmlExecutionProvider' in availible_providers:
-            providers_list.append('DmlExecutionProvider')
-        providers_list.append('CPUExecutionProvider')
+        for blob, patch in zip(img_blob, patches):
+            np.copyto(blob, patch.transpose(2, 0, 1), casting='unsafe')
+        img_blob /= 255.0
         
+        self.binding.bind_input(self.input_name, 'cpu', 0, self.input_dtype, img_blob.shape, img_blob.ctypes.data)
+        self.binding.bind_output(self.output_name, 'cpu', 0, self.output_dtype, output.shape, output.ctypes.data)
+            
         try:
-            self.session = ort.InferenceSession(model_path, sess_options=options, providers=providers_list)
+            self.session.run_with_iobinding(self.binding, self.run_options)
         except Exception as e:
-            logging.error(f'Failed to create ONNX Runtime session: {e}')
-            raise RuntimeError(f'Failed to create ONNX Runtime session: {e}')
+            if self.run_options.terminate:
+                raise InterruptedError('Stopped by user.')
+            logging.error(f'Error processing image: {e}')
+            raise RuntimeError(f'Error processing image: {e}')
+        
+        np.clip(output, 0, 1, out=output)
+        output *= 255.0
+        np.rint(output, out=output)
+        
+        # NCHW RGB -> NHWC BGR одним копированием
+        np.copyto(result, output[:, ::-1].transpose(0, 2, 3, 1), casting='unsafe')
+        
+        return result
+
+class TileProgress:
+    """
+    Ход обработки тайлов одного изображения. Скорость меряется только по тайлам, прошедшим через нейросеть,
+    из неё оценивается оставшееся время. Тайлы считают потоки параллельных сессий, поэтому счётчик под блокировкой.
+    """
+    def __init__(self, total:int, callback, done:int = 0):
+        """
+        - callback: функция (готово тайлов, всего тайлов, оставшееся время в секундах или None).
+        - done: тайлы, готовые сразу (однородные и взятые из предыдущего кадра).
+        """
+        self.total = total
+        self.done = done
+        self.skipped = done
+        self.callback = callback
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+    
+    def add(self, count:int):
+        with self.lock:
+            self.done += count
+            elapsed = time.perf_counter() - self.started
+            rate = (self.done - self.skipped) / elapsed if elapsed > 0 else 0
+            eta = (self.total - self.done) / rate if rate > 0 else None
+            self.callback(self.done, self.total, eta)
+
+class Upscaler:
+    def __init__(self, model_path:str, scale:int = 4, batch_size:int|None = 1, tuning:dict|None = None, cache_dir:str|None = None,
+                 parallel_sessions:int = 1, threads_per_session:int|None = None, tile_align:int = 2,
+                 flat_threshold:float|None = FLAT_TILE_THRESHOLD, instance:int = 0):
+        """
+        - model_path: путь к ONNX модели.
+        - scale: коэффициент увеличения модели.
+        - batch_size: количество тайлов в одном вызове сессии. None - подобрать по бюджету памяти.
+        - tuning: параметры, подобранные автотюнером (tile_size, потоки, режим исполнения).
+        - cache_dir: папка кэша оптимизированных графов. None - кэш не используется.
+        - parallel_sessions: количество сессий, параллельно обрабатывающих тайлы одного изображения (только CPU).
+        - threads_per_session: потоки внутри каждой сессии на CPU. None - в параллельном режиме поровну разделить
+          физические ядра, иначе решает ONNX Runtime.
+        - tile_align: кратность сторон тайла (x2 модель делает pixel_unshuffle, стороны должны быть чётными).
+        - flat_threshold: порог стандартного отклонения тайла (с контекстом), ниже которого тайл считается однородным
+          и увеличивается бикубической интерполяцией вместо нейросети. None - все тайлы идут через нейросеть.
+        - instance: номер копии Upscaler (см. clone). Сессии копий не пересекаются в реестре.
+        """
+        self.settings = dict(model_path=model_path, scale=scale, batch_size=batch_size, tuning=tuning, cache_dir=cache_dir,
+                             parallel_sessions=parallel_sessions, threads_per_session=threads_per_session,
+                             tile_align=tile_align, flat_threshold=flat_threshold)
+        self.scale = scale
+        self.tile_align = tile_align
+        self.flat_threshold = flat_threshold
+        # Доля однородных тайлов последнего изображения: сколько увеличено интерполяцией из скольких проверенных
+        self.flat_tiles = 0
+        self.checked_tiles = 0
+        self.model_path = model_path
+        self.last_plan = None
+        self.executor = None
+        self.clones = weakref.WeakSet() # Живые копии для параллельных потоков, отмена распространяется и на них
+        
+        logging.info(f'Available ONNX Runtime providers: {ort.get_available_providers()}')
+        providers_list = get_providers_list()
+        
+        if parallel_sessions > 1 and providers_list[0] != 'CPUExecutionProvider':
+            logging.info(f'Parallel sessions are only used on CPU, provider: {providers_list[0]}')
+            parallel_sessions = 1
+        
+        if parallel_sessions > 1 or threads_per_session:
+            physical, _ = get_cpu_threads()
+            threads = threads_per_session or max(1, physical // parallel_sessions)
+            tuning = dict(tuning or {}, execution_mode='sequential', intra_op_threads=threads, inter_op_threads=1)
+            logging.info(f'CPU sessions: {parallel_sessions} x {threads} threads')
+        
+        first = instance * parallel_sessions
+        self.session = create_session(model_path, providers_list, tuning, cache_dir, first)
+        self.runners = [TileRunner(self.session, scale)]
+        for k in range(1, parallel_sessions):
+            self.runners.append(TileRunner(create_session(model_path, providers_list, tuning, cache_dir, first + k), scale))
         
         active_provider = self.session.get_providers()[0]
-        input_type = self.session.get_inputs()[0].type
-        self.is_fp16 = 'float16' in input_type
+        self.provider = active_provider
+        self.is_fp16 = self.runners[0].input_dtype == np.float16
         
         logging.info(f'ONNX Runtime session created with provider: {active_provider}, model precision: {"FP16" if self.is_fp16 else "FP32"}')
         
@@ -45,85 +250,375 @@ class Upscaler:
             memory_coef = 25000
         else:
             memory_coef = 30000
+        self.memory_coef = memory_coef # Байт памяти на пиксель тайла
             
         pixel_limit = self.vram_bytes / memory_coef
         
         side = int(math.sqrt(pixel_limit))
         self.tile_size = max((side // 32) * 32, 256) # Кратность 32 для оптимизации, минимум 256 пикселей
+        self.max_tile_size = self.tile_size
+        
+        if tuning and 'tile_size' in tuning:
+            self.tile_size = tuning['tile_size']
+            logging.info(f'Using tuned settings: {tuning}')
+            if batch_size is None:
+                batch_size = int(pixel_limit // (self.tile_size ** 2))
         
-        logging.info(f'VRAM: {self.vram_bytes / 1024**3:.2f} GB. Pixel limit: {int(pixel_limit)}. Tile size: {self.tile_size}x{self.tile_size}')
+        if batch_size is None:
+            # Бюджет делится между несколькими тайлами меньшего размера
+            self.tile_size = min(self.tile_size, BATCH_TILE_SIZE)
+            batch_size = int(pixel_limit // (self.tile_size ** 2))
+        # Параллельные сессии делят между собой один бюджет памяти
+        tile_size = self.tile_size
+        self.tile_size, self.batch_size = self.split_budget(pixel_limit, tile_size, batch_size)
+        if self.tile_size < tile_size:
+            log = logging.warning if tuning and 'tile_size' in tuning else logging.info
+            log(f'{len(self.runners)} sessions share the memory budget, tile size reduced from {tile_size} to {self.tile_size}')
+        
+        logging.info(f'VRAM: {self.vram_bytes / 1024**3:.2f} GB. Pixel limit: {int(pixel_limit)}. Tile size: {self.tile_size}x{self.tile_size}, batch: {self.batch_size}')
+    
+    def clone(self, instance:int, threads_per_session:int|None = None) -> 'Upscaler':
+        """
+        Создаёт копию с теми же настройками и собственными сессиями, чтобы несколько потоков
+        могли обрабатывать разные изображения одновременно. Текущий размер тайла и пачки переносится в копию.
+        - instance: номер копии (от 1), определяет ключи её сессий в реестре.
+        - threads_per_session: потоки внутри каждой сессии копии на CPU.
+        """
+        settings = dict(self.settings, threads_per_session=threads_per_session or self.settings['threads_per_session'])
+        upscaler = Upscaler(**settings, instance=instance)
+        upscaler.tile_size = self.tile_size
+        upscaler.batch_size = self.batch_size
+        self.clones.add(upscaler)
+        return upscaler
     
-    def process_image(self, img:np.ndarray, tile_pad=10, check_interrupt=None) -> np.ndarray:
+    def cancel(self):
+        """
+        Прерывает идущие вызовы сессий за миллисекунды (RunOptions.terminate), не дожидаясь конца тайла.
+        Обработка бросает InterruptedError, и все следующие вызовы тоже: после отмены экземпляр не используется,
+        UpscaleWorker загружает модели заново на каждый запуск.
+        """
+        for runner in self.runners:
+            runner.run_options.terminate = True
+        for upscaler in list(self.clones):
+            upscaler.cancel()
+    
+    def split_budget(self, pixel_limit:float, tile_size:int, batch_size:int) -> tuple:
+        """
+        Делит бюджет пикселей между параллельными сессиями. Возвращает (размер тайла, пачка одной сессии).
+        Если общая пачка меньше числа сессий, делить её нечего, а каждая сессия одновременно держит свой тайл,
+        поэтому тайл уменьшается до доли бюджета одной сессии.
+        - batch_size: сколько тайлов размера tile_size помещается в бюджет на все сессии.
+        """
+        sessions = len(self.runners)
+        if batch_size < sessions:
+            tile_size = min(tile_size, max(int(math.sqrt(pixel_limit / sessions)) // 32 * 32, MIN_TILE_SIZE))
+            batch_size = int(pixel_limit // tile_size ** 2)
+        return tile_size, max(1, min(batch_size // sessions, MAX_BATCH_SIZE))
+    
+    def with_memory_limit(self, limit:int) -> 'Upscaler':
+        """
+        Возвращает копию, у которой тайл и пачка уложены в limit байт (доля бюджета MemoryGovernor).
+        Сессии у копии общие с этим экземпляром, а сам он не меняется: предел действует только на одно видео,
+        следующие файлы снова работают с тайлом, подобранным по памяти или автотюнером.
+        Если предел уменьшает тайл из автоподбора, это пишется в лог.
+        """
+        pixel_limit = limit / self.memory_coef
+        tile_size = min(self.tile_size, max(int(math.sqrt(pixel_limit)) // 32 * 32, MIN_TILE_SIZE))
+        tile_size, batch_size = self.split_budget(pixel_limit, tile_size, int(pixel_limit // tile_size ** 2))
+        batch_size = min(self.batch_size, batch_size)
+        
+        if tile_size == self.tile_size and batch_size == self.batch_size:
+            return self
+        
+        upscaler = copy.copy(self) # Раннеры и реестр копий общие, поэтому cancel исходного экземпляра останавливает и эту копию
+        upscaler.executor = None
+        upscaler.last_plan = None
+        upscaler.tile_size = tile_size
+        upscaler.batch_size = batch_size
+        
+        tuned = (self.settings['tuning'] or {}).get('tile_size')
+        if tuned and tile_size < tuned:
+            logging.warning(f'Memory budget {limit / 1024**3:.2f} GB overrides tuned tile size {tuned}: using {tile_size}x{tile_size}, batch: {batch_size}')
+        else:
+            logging.info(f'Memory budget {limit / 1024**3:.2f} GB for tiles. Tile size: {tile_size}x{tile_size}, batch: {batch_size}')
+        return upscaler
+    
+    def process_image(self, img:np.ndarray, tile_pad=10, check_interrupt=None, reuse:TileReuseCache|None = None,
+                      out:np.ndarray|None = None, progress=None) -> np.ndarray:
         """
         Основной метод для обработки изображения с тайлингом.
         - img: входное изображение в формате BGR (uint8).
         - tile_pad: размер паддинга для каждого тайла (в пикселях).
+        - reuse: кэш предыдущего кадра видео. Неизменившиеся тайлы копируются из предыдущего результата.
+        - out: массив (h * scale, w * scale, 3) для результата, например слот FrameRing. None - создаётся новый.
+        - progress: функция (готово тайлов, всего тайлов, оставшееся время в секундах или None), см. TileProgress.
+        После вызова flat_tiles и checked_tiles говорят, сколько тайлов изображения увеличено интерполяцией
+        из скольких проверенных на однородность. Изображение, которое помещается в один тайл, целиком идёт
+        в нейросеть и на однородность не проверяется (оба счётчика 0), как и тайлы, взятые из reuse.
         """
         img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
         h, w, c = img.shape
+        self.flat_tiles = 0
+        self.checked_tiles = 0
         
         if h <= self.tile_size and w <= self.tile_size:
             pad_h = h % 2
             pad_w = w % 2
             
+            patch = img
             if pad_h != 0 or pad_w != 0:
-                img = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
+                patch = cv2.copyMakeBorder(img, 0, pad_h, 0, pad_w, cv2.BORDER_REFLECT_101)
             
-            res = self.process_patch(img)
+            # Изображение целиком - один тайл без контекста, повторное использование работает так же, как при тайлинге
+            whole = [(0, 0, patch.shape[0], patch.shape[1])]
+            unchanged = reuse.find_unchanged(patch, whole, 0) if reuse is not None else np.zeros(1, dtype=bool)
             
-            return res[:h*self.scale, :w*self.scale, :]
-        
-        actual_tile_size = self.tile_size
+            try:
+                if unchanged[0]:
+                    res = reuse.output
+                else:
+                    res = self.process_patch(patch)[:h*self.scale, :w*self.scale, :]
+                if progress:
+                    progress(1, 1, 0.0)
+                if out is None:
+                    out = res.copy() if unchanged[0] else res
+                else:
+                    out[:] = res
+                if reuse is not None:
+                    reuse.update(patch, out, whole, unchanged, 0, self.scale)
+                return out
+            except (RuntimeError, MemoryError) as e:
+                # Не хватило памяти на изображение целиком - дальше обычный тайлинг меньшими тайлами
+                if max(h, w) <= MIN_TILE_SIZE:
+                    raise
+                self.shrink_tile_size(max(h, w) // 2, e)
         
-        pad_h_mod = (actual_tile_size - (h % actual_tile_size)) % actual_tile_size
-        pad_w_mod = (actual_tile_size - (w % actual_tile_size)) % actual_tile_size
+        plan = plan_tiles(h, w, self.tile_size, tile_pad, self.tile_align)
+        if self.last_plan is None or (self.last_plan.rows, self.last_plan.cols) != (plan.rows, plan.cols):
+            logging.info(f'Tile plan: {plan}')
+        self.last_plan = plan
         
         img_padded = cv2.copyMakeBorder(
             img, 
-            tile_pad, tile_pad + pad_h_mod, 
-            tile_pad, tile_pad + pad_w_mod, 
+            tile_pad, tile_pad + plan.covered_h - h, 
+            tile_pad, tile_pad + plan.covered_w - w, 
             cv2.BORDER_REFLECT_101
         )
         
-        target_h = (h + pad_h_mod) * self.scale
-        target_w = (w + pad_w_mod) * self.scale
-        img_up = np.zeros((target_h, target_w, c), dtype=np.uint8)
+        # Раскладка покрывает всё изображение, поэтому готовый массив не нужно обнулять
+        img_up = out if out is not None else np.zeros((h * self.scale, w * self.scale, c), dtype=np.uint8)
         
-        for y in range(0, h + pad_h_mod, actual_tile_size):
-            for x in range(0, w + pad_w_mod, actual_tile_size):
-                y_start = y
-                y_end = y + actual_tile_size + (tile_pad * 2)
-                x_start = x
-                x_end = x + actual_tile_size + (tile_pad * 2)
-                
-                patch = img_padded[y_start:y_end, x_start:x_end, :]
-                
+        tiles = plan.tiles()
+        
+        reused_tiles = []
+        if reuse is not None:
+            all_tiles = tiles
+            unchanged = reuse.find_unchanged(img_padded, all_tiles, tile_pad)
+            reused_tiles = [tile for tile, keep in zip(all_tiles, unchanged) if keep]
+            tiles = [tile for tile, keep in zip(all_tiles, unchanged) if not keep]
+        
+        flat_tiles = []
+        if self.flat_threshold is not None and tiles:
+            deviation = tile_deviation(img_padded, tiles, tile_pad)
+            flat_tiles = [tile for tile, d in zip(tiles, deviation) if d <= self.flat_threshold]
+            tiles = [tile for tile, d in zip(tiles, deviation) if d > self.flat_threshold]
+        
+        # Долю по изображению пишет ImageBatchWorker, в видео с повторным использованием тайлов число копится в кэше,
+        # а итог за всё видео пишет VideoUpscaleWorker
+        self.flat_tiles = len(flat_tiles)
+        self.checked_tiles = len(flat_tiles) + len(tiles)
+        if reuse is not None:
+            reuse.flat_tiles += len(flat_tiles)
+        
+        # Тайлы одного размера собираются в общие пачки
+        groups = {}
+        for tile in tiles:
+            groups.setdefault(tile[2:], []).append(tile)
+        
+        batches = [
+            group[i:i + self.batch_size]
+            for group in groups.values()
+            for i in range(0, len(group), self.batch_size)
+        ]
+        
+        valid_start = tile_pad * self.scale
+        
+        def get_patch(tile):
+            y, x, th, tw = tile
+            return img_padded[y:y + th + (tile_pad * 2), x:x + tw + (tile_pad * 2), :]
+        
+        def write_tile(tile, chunk):
+            y, x, th, tw = tile
+            
+            # Часть тайла за границей изображения отбрасывается
+            h_c = (min(y + th, h) - y) * self.scale
+            w_c = (min(x + tw, w) - x) * self.scale
+            
+            dest_y = y * self.scale
+            dest_x = x * self.scale
+            
+            img_up[dest_y : dest_y + h_c, dest_x : dest_x + w_c, :] = chunk[valid_start:valid_start + h_c, valid_start:valid_start + w_c, :]
+        
+        tracker = None
+        if progress:
+            tracker = TileProgress(len(tiles) + len(flat_tiles) + len(reused_tiles), progress, len(flat_tiles) + len(reused_tiles))
+            if not batches:
+                tracker.add(0)
+        
+        def run_batch(batch, runner):
+            patches = [get_patch(tile) for tile in batch]
+            for tile, chunk in zip(batch, self.process_tiles(patches, tile_pad, runner)):
+                write_tile(tile, chunk)
+            if tracker:
+                tracker.add(len(batch))
+        
+        for y, x, th, tw in reused_tiles:
+            y0, x0 = y * self.scale, x * self.scale
+            y1, x1 = min(y + th, h) * self.scale, min(x + tw, w) * self.scale
+            img_up[y0:y1, x0:x1] = reuse.output[y0:y1, x0:x1]
+        
+        for tile in flat_tiles:
+            write_tile(tile, self.interpolate_patch(get_patch(tile)))
+        
+        if len(self.runners) > 1 and len(batches) > 1:
+            self.run_parallel(batches, run_batch, check_interrupt)
+        else:
+            for batch in batches:
                 if check_interrupt and check_interrupt():
                     raise InterruptedError('Stopped by user.')
                 
-                try:
-                    chunk = self.process_patch(patch)
-                except Exception as e:
-                    logging.error(f'Error processing tile at ({y}:{x}): {e}')
-                    h_patch, w_patch, _ = patch.shape
-                    chunk = np.zeros((h_patch * self.scale, w_patch * self.scale, c), dtype=np.uint8)
-                
-                valid_start = tile_pad * self.scale
-                valid_end = valid_start + (actual_tile_size * self.scale)
-                
-                chunk = chunk[valid_start:valid_end, valid_start:valid_end, :]
-                
-                dest_y = y * self.scale
-                dest_x = x * self.scale
-                
-                h_c, w_c, _ = chunk.shape
-                img_up[dest_y : dest_y + h_c, dest_x : dest_x + w_c, :] = chunk
-                
-        final_h = h * self.scale
-        final_w = w * self.scale
+                run_batch(batch, self.runners[0])
+        
+        if reuse is not None:
+            reuse.update(img_padded, img_up, all_tiles, unchanged, tile_pad, self.scale)
         
         gc.collect()
-        return img_up[:final_h, :final_w, :]
+        return img_up
+    
+    def process_to_size(self, img:np.ndarray, size:tuple, tile_pad=10, check_interrupt=None, progress=None) -> np.ndarray:
+        """
+        Режим целевого размера: увеличивает изображение до size (ширина, высота) по плану plan_for_scale.
+        Вход заранее уменьшается, если модель увеличивает больше, чем нужно, остаток закрывает resize результата.
+        """
+        h, w = img.shape[:2]
+        plan = plan_for_scale(w, h, size, self.scale)
+        img_up = self.process_image(resize_image(img, plan['input']), tile_pad, check_interrupt, progress=progress)
+        return resize_image(img_up, plan['output'])
+    
+    def run_parallel(self, batches:list, run_batch, check_interrupt=None):
+        """
+        Раздаёт пачки тайлов свободным сессиям в пуле потоков. Сессии отпускают GIL на время вычислений,
+        а тайлы пишут в непересекающиеся области холста, поэтому блокировки не нужны.
+        """
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.runners), thread_name_prefix='tile')
+        
+        free_runners = queue.Queue()
+        for runner in self.runners:
+            free_runners.put(runner)
+        
+        stop_event = threading.Event()
+        
+        def job(batch):
+            if stop_event.is_set():
+                return
+            runner = free_runners.get()
+            try:
+                run_batch(batch, runner)
+            finally:
+                free_runners.put(runner)
+        
+        pending = {self.executor.submit(job, batch) for batch in batches}
+        try:
+            while pending:
+                if check_interrupt and check_interrupt():
+                    raise InterruptedError('Stopped by user.')
+                
+                done, pending = concurrent.futures.wait(pending, timeout=0.1, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+        finally:
+            if pending:
+                stop_event.set()
+                for future in pending:
+                    future.cancel()
+                concurrent.futures.wait(pending)
+    
+    def process_tiles(self, patches:list, tile_pad:int, runner:TileRunner|None = None) -> list:
+        """
+        Обрабатывает пачку тайлов одинакового размера.
+        Если пакетный вызов не удался, переходит на обработку по одному тайлу.
+        Тайлы, на которые не хватило памяти, делятся на части (см. process_split).
+        Результаты могут указывать во внутренний буфер раннера и действительны до следующего вызова.
+        - patches: список тайлов (H, W, 3) в формате RGB (uint8), с контекстом tile_pad с каждой стороны.
+        - runner: сессия для обработки. None - основная сессия.
+        """
+        runner = runner or self.runners[0]
+        
+        h_patch, w_patch, _ = patches[0].shape
+        fits = max(h_patch, w_patch) - tile_pad * 2 <= self.tile_size
+        
+        if len(patches) > 1 and fits:
+            try:
+                return list(runner.run(patches))
+            except (RuntimeError, MemoryError) as e:
+                logging.warning(f'Batch of {len(patches)} tiles failed, falling back to single tiles: {e}')
+                self.batch_size = 1
+        
+        return [self.process_split(patch, tile_pad, runner) for patch in patches]
+    
+    def process_split(self, patch:np.ndarray, tile_pad:int, runner:TileRunner) -> np.ndarray:
+        """
+        Обрабатывает один тайл с контекстом tile_pad.
+        Если на тайл не хватило памяти, tile_size уменьшается до половины тайла и остаётся таким до конца задачи,
+        а сам тайл рекурсивно делится на части со своим контекстом, вырезанные из того же куска.
+        Тайлы больше текущего tile_size (спланированные до уменьшения) делятся сразу, без повторной ошибки.
+        Возвращает результат того же вида, что и TileRunner.run для одного тайла, но в собственном массиве.
+        """
+        h_patch, w_patch, c = patch.shape
+        core_h = h_patch - tile_pad * 2
+        core_w = w_patch - tile_pad * 2
+        
+        if max(core_h, core_w) <= self.tile_size:
+            try:
+                return runner.run([patch])[0].copy()
+            except (RuntimeError, MemoryError) as e:
+                if max(core_h, core_w) <= MIN_TILE_SIZE:
+                    raise
+                self.shrink_tile_size(max(core_h, core_w) // 2, e)
+        
+        # Стороны тайла кратны tile_align, поэтому начала и размеры частей тоже
+        rows = [(y, min(size, core_h - y)) for y, size in plan_axis(core_h, self.tile_size, tile_pad, self.tile_align) if y < core_h]
+        cols = [(x, min(size, core_w - x)) for x, size in plan_axis(core_w, self.tile_size, tile_pad, self.tile_align) if x < core_w]
+        
+        s = self.scale
+        result = np.zeros((h_patch * s, w_patch * s, c), dtype=np.uint8)
+        for y, sh in rows:
+            for x, sw in cols:
+                sub = patch[y:y + sh + tile_pad * 2, x:x + sw + tile_pad * 2]
+                chunk = self.process_split(sub, tile_pad, runner)
+                
+                dest_y = (tile_pad + y) * s
+                dest_x = (tile_pad + x) * s
+                result[dest_y:dest_y + sh * s, dest_x:dest_x + sw * s] = chunk[tile_pad * s:(tile_pad + sh) * s, tile_pad * s:(tile_pad + sw) * s]
+        return result
+    
+    def shrink_tile_size(self, size:int, error:Exception):
+        """
+        Уменьшает рабочий размер тайла после нехватки памяти. Размер только уменьшается,
+        поэтому одновременные вызовы из параллельных сессий безопасны.
+        """
+        size = max(align_up(size, self.tile_align), MIN_TILE_SIZE)
+        if size < self.tile_size:
+            self.tile_size = size
+            logging.warning(f'Tile failed ({error}), reducing tile size to {size}x{size}')
+    
+    def interpolate_patch(self, patch:np.ndarray) -> np.ndarray:
+        """
+        Увеличивает однородный кусок бикубической интерполяцией. Результат в том же виде, что у process_patch (BGR).
+        """
+        patch_up = cv2.resize(patch, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_CUBIC)
+        return cv2.cvtColor(patch_up, cv2.COLOR_RGB2BGR)
     
     def process_patch(self, patch:np.ndarray) -> np.ndarray:
         """
@@ -131,30 +626,35 @@ class Upscaler:
         Возвращает сырой результат (с паддингами, в BGR формате).
         - patch: входной кусок изображения (RGB, uint8).
         """
-        if self.is_fp16:
-            img_blob = (patch.astype(np.float16) / 255.0)
-        else:
-            img_blob = (patch.astype(np.float32) / 255.0)
-            
-        img_blob = np.transpose(img_blob, (2, 0, 1))
-        img_blob = np.expand_dims(img_blob, axis=0)
-        img_blob = np.ascontiguousarray(img_blob)
-            
+        return self.process_batch([patch])[0].copy()
+    
+    def process_batch(self, patches:list) -> np.ndarray:
+        """
+        Прогоняет пачку кусков одинакового размера через основную сессию.
+        Возвращает внутренний буфер (N, H*scale, W*scale, 3) в BGR формате.
+        - patches: входные куски (H, W, 3) в формате RGB (uint8).
+        """
+        return self.runners[0].run(patches)
+
+
+def start_warmup(create, tile_pad:int = 10) -> threading.Thread:
+    """
+    Загружает модель в реестр сессий в фоновом потоке и делает пробный прогон каждой сессии на тайле ожидаемого размера,
+    чтобы первый запуск обработки не тратил время на загрузку и первичную инициализацию.
+    - create: функция без аргументов, создающая Upscaler так же, как его создаст обработка (иначе ключи сессий
+      в реестре не совпадут). Вызывается в фоновом потоке вместе с подготовкой настроек (автоподбор, выбор модели).
+    """
+    def warmup():
         try:
-            outputs = self.session.run(None, {'input': img_blob})
-            result = outputs[0]
+            upscaler = create()
+            side = upscaler.tile_size + tile_pad * 2
+            patch = np.zeros((side, side, 3), dtype=np.uint8)
+            for runner in upscaler.runners:
+                runner.run([patch] * upscaler.batch_size)
+            logging.info(f'Model warmed up: {os.path.basename(upscaler.settings["model_path"])}')
         except Exception as e:
-            logging.error(f'Error processing image: {e}')
-            raise RuntimeError(f'Error processing image: {e}')
-        
-        if not isinstance(result, np.ndarray):
-            raise TypeError('Model output is not a numpy array.')
-            
-        result = result[0]
-        result = np.clip(result, 0, 1)
-        result = np.transpose(result, (1, 2, 0))
-        
-        result = (result * 255.0).round().astype(np.uint8)
-        result = cv2.cvtColor(result, cv2.COLOR_RGB2BGR)
-        
-        return result
\ No newline at end of file
+            logging.warning(f'Model warmup failed: {e}')
+    
+    thread = threading.Thread(target=warmup, daemon=True)
+    thread.start()
+    return thread
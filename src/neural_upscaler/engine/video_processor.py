@@ -3,34 +3,231 @@ import queue
 import cv2
 import os
 import shutil
+import time
 import logging
-from neural_upscaler.engine.ffmpeg_wrapper import start_ffmpeg_process
+from neural_upscaler.engine.ffmpeg_wrapper import start_ffmpeg_process, start_decoder_process, probe_video, EncoderProgress, X264_PRESETS
+from neural_upscaler.engine.tiling import TileReuseCache
+from neural_upscaler.engine.frame_ring import FrameRing
+from neural_upscaler.engine.memory import MemoryGovernor
+from neural_upscaler.engine.planning import get_target_size, plan_for_scale, resize_image
+from neural_upscaler.utils.system import get_cpu_threads
+
+THUMB_WIDTH = 160 # Ширина уменьшенной копии кадра для поиска повторов
+DUPLICATE_THRESHOLD = 3 # Максимальная разница пикселей уменьшенных копий (из 255), при которой кадр считается повтором
+ENCODER_BUSY = 0.25 # Доля времени писателя в ожидании энкодера, выше которой энкодер - узкое место
+ENCODER_IDLE = 0.05 # Доля ниже этой - энкодер простаивает
+QUEUE_FULL = 0.8 # Средняя заполненность очереди записи, при которой энкодер не успевает за нейросетью
+QUEUE_EMPTY = 0.2
+
+def get_encoder_threads(upscaler) -> int:
+    """
+    Начальное число потоков x264. На CPU энкодер делит ядра с нейросетью, поэтому получает их четверть.
+    На GPU - автоматически (0).
+    """
+    if upscaler.provider == 'CPUExecutionProvider':
+        physical, _ = get_cpu_threads()
+        return max(2, physical // 4)
+    return 0
+
+class EncoderTuner:
+    """
+    Подбирает пресет x264 и потоки энкодера между частями видео (файлами или сегментами), чтобы кодирование
+    не тормозило нейросеть. Пресет и потоки задаются при запуске FFmpeg, поэтому меняются только на границе частей:
+    внутри одного видео - если оно обрабатывается частями (SegmentedVideoWorker), иначе - между файлами.
+    Начинает с самого медленного допустимого пресета (для 'balanced' это прежний medium) и ускоряется, только если
+    писатель заметную долю всей части ждал энкодер. Если энкодер затем простаивал, следующая часть снова кодируется
+    медленнее (меньше размер), а на самом быстром пресете энкодер получает больше потоков.
+    """
+    def __init__(self, fastest:str = 'veryfast', slowest:str = 'medium', threads:int = 0):
+        """
+        - fastest, slowest: границы пресетов x264, которые разрешил пользователь.
+        - threads: начальное число потоков энкодера. 0 - автоматически, тогда подбирается только пресет.
+        """
+        self.presets = X264_PRESETS[X264_PRESETS.index(fastest):X264_PRESETS.index(slowest) + 1]
+        self.index = len(self.presets) - 1
+        self.threads = threads
+        self.max_threads = get_cpu_threads()[1]
+    
+    @property
+    def preset(self) -> str:
+        return self.presets[self.index]
+    
+    def update(self, busy:float, queue_fill:float):
+        """
+        Учитывает замеры прошедшей части.
+        - busy: доля времени, которую писатель ждал запись в энкодер.
+        - queue_fill: средняя заполненность очереди записи (0..1).
+        """
+        if busy > ENCODER_BUSY or queue_fill > QUEUE_FULL:
+            if self.index > 0:
+                self.index -= 1
+            elif self.threads and self.threads < self.max_threads:
+                self.threads = min(self.max_threads, self.threads * 2)
+        elif busy < ENCODER_IDLE and queue_fill < QUEUE_EMPTY and self.index < len(self.presets) - 1:
+            self.index += 1
 
 class VideoUpscaleWorker:
-    def __init__(self, upscaler):
+    def __init__(self, upscaler, duplicate_threshold:float|None = DUPLICATE_THRESHOLD, tile_reuse:bool = True, refresh_interval:int = 60,
+                 workers:int = 1, encoder_tuner:EncoderTuner|None = None, governor:MemoryGovernor|None = None,
+                 target_size:int|None = None):
+        """
+        - workers: количество потоков, параллельно обрабатывающих кадры, у каждого свои сессии (см. Upscaler.clone).
+          Если кадры не помещаются в бюджет памяти, потоков будет меньше.
+        - duplicate_threshold: порог поиска повторяющихся кадров (см. is_duplicate). None - обрабатывать все кадры.
+        - tile_reuse: заново обрабатывать только изменившиеся тайлы кадра (см. TileReuseCache).
+        - refresh_interval: через сколько кадров кадр обрабатывается целиком, даже если тайлы не менялись.
+        - encoder_tuner: общий для нескольких видео или частей подбор настроек энкодера. None - свой на каждое видео.
+        - governor: бюджет памяти, из которого выводятся глубина очередей, число потоков и размер тайла.
+          None - бюджет по свободной памяти.
+        - target_size: меньшая сторона результата. Декодер заранее уменьшает кадры, если модель увеличивает больше нужного,
+          энкодер приводит результат модели к целевому размеру (см. plan_for_scale). None - результат в масштабе модели.
+        """
         self.upscaler = upscaler
+        self.target_size = target_size
+        self.frame_size = None # (ширина, высота) кадров на входе нейросети
+        self.duplicate_threshold = duplicate_threshold
+        self.tile_reuse = tile_reuse
+        self.refresh_interval = refresh_interval
+        self.workers = max(1, workers)
+        self.active_workers = self.workers # Сколько потоков запущено с учётом бюджета памяти
+        self.governor = governor or MemoryGovernor()
+        self.tile_caches = []
         self.read_queue = queue.Queue(maxsize=5)
         self.write_queue = queue.Queue(maxsize=5)
         self.stop_event = threading.Event()
+        self.duplicate_frames = 0
+        self.encoder_tuner = encoder_tuner or EncoderTuner(threads=get_encoder_threads(upscaler))
+        self.encoder_wait = 0.0 # Время, которое писатель ждал запись в энкодер
+        self.fps = 0.0 # Скорость обработки: записанные кадры в секунду с начала видео
+        self.started = 0.0
+        self.queue_fill = 0.0 # Сумма заполненности очереди записи по записанным кадрам
+        self.queue_samples = 0
+        
+        # Кадры передаются между потоками номерами слотов в кольцах (см. FrameRing), кольца создаются под размер видео
+        self.input_ring = None
+        self.output_ring = None
         
-    def reader_thread(self, video_path):
+        # Номер следующего кадра для записи. Обработчики не уходят вперёд него больше чем на reorder_window кадров,
+        # поэтому буфер перестановки в писателе ограничен
+        self.next_frame = 1
+        self.reorder_window = self.write_queue.maxsize + self.active_workers
+        self.order_condition = threading.Condition()
+    
+    def create_upscalers(self, upscaler, workers:int) -> list:
+        """
+        Экземпляры Upscaler для обработчиков кадров. На CPU ядра делятся между копиями поровну,
+        на GPU основной экземпляр работает вместе с копиями, а видеопамять делится между ними поровну.
+        - upscaler: основной экземпляр для этого видео (с пределом памяти, см. Upscaler.with_memory_limit).
+        """
+        if workers <= 1:
+            return [upscaler]
+        
+        if upscaler.provider == 'CPUExecutionProvider':
+            physical, _ = get_cpu_threads()
+            threads = max(1, physical // (workers * len(upscaler.runners)))
+            upscalers = [upscaler.clone(k + 1, threads) for k in range(workers)]
+        else:
+            # Видеопамять одна на все сессии: тайл и пачка каждого обработчика рассчитываются на свою долю,
+            # как у параллельных сессий на CPU
+            upscaler = upscaler.with_memory_limit(upscaler.vram_bytes // workers)
+            upscalers = [upscaler] + [upscaler.clone(k) for k in range(1, workers)]
+        
+        logging.info(f'Video frame workers: {workers}')
+        return upscalers
+    
+    def read_frames_opencv(self, video_path):
+        """
+        Запасной декодер через OpenCV, если FFmpeg/ffprobe недоступны. Кадры копируются в слоты input_ring.
+        """
         video = cv2.VideoCapture(video_path)
+        try:
+            while video.isOpened():
+                ret, frame = video.read()
+                if not ret:
+                    break
+                slot = self.input_ring.acquire(self.stop_event)
+                if slot is None:
+                    break
+                self.input_ring[slot][:] = resize_image(frame, self.frame_size)
+                yield slot
+        finally:
+            video.release()
+    
+    def read_frames_ffmpeg(self, video_path, meta, segment=None):
+        """
+        Декодирует кадры процессом FFmpeg (многопоточный декодер) прямо в слоты input_ring. Возвращает номера слотов.
+        """
+        w, h = self.frame_size
+        scale = (w, h) != (meta['width'], meta['height'])
+        if segment:
+            process = start_decoder_process(video_path, w, h, start=segment['start'], frames=segment['frames'], scale=scale)
+        else:
+            process = start_decoder_process(video_path, w, h, scale=scale)
+        
+        try:
+            while True:
+                slot = self.input_ring.acquire(self.stop_event)
+                if slot is None:
+                    break
+                buffer = self.input_ring.view(slot)
+                
+                filled = 0
+                while filled < len(buffer):
+                    count = process.stdout.readinto(buffer[filled:])
+                    if not count:
+                        break
+                    filled += count
+                
+                if filled < len(buffer):
+                    self.input_ring.release(slot)
+                    break
+                yield slot
+        finally:
+            process.kill()
+            process.wait()
+    
+    def make_thumbnail(self, frame):
+        h, w = frame.shape[:2]
+        thumb_w = min(THUMB_WIDTH, w)
+        thumb_h = max(1, round(h * thumb_w / w))
+        return cv2.resize(frame, (thumb_w, thumb_h), interpolation=cv2.INTER_AREA)
+    
+    def is_duplicate(self, thumb, reference) -> bool:
+        """
+        Кадр считается повтором, если ни один пиксель уменьшенной копии не отличается от опорного
+        больше чем на duplicate_threshold. Сравнение идёт с последним обработанным кадром,
+        поэтому медленные изменения не накапливаются.
+        """
+        if reference is None or self.duplicate_threshold is None:
+            return False
+        return cv2.absdiff(thumb, reference).max() <= self.duplicate_threshold
+        
+    def reader_thread(self, video_path, meta=None, segment=None):
+        frames = self.read_frames_ffmpeg(video_path, meta, segment) if meta else self.read_frames_opencv(video_path)
         i = 0
+        reference = None
         
-        while video.isOpened() and not self.stop_event.is_set():
-            ret, frame = video.read()
-            if not ret:
+        for slot in frames:
+            if self.stop_event.is_set():
+                self.input_ring.release(slot)
                 break
             
             i += 1
-            while not self.stop_event.is_set():
-                try:
-                    self.read_queue.put((i, frame), timeout=0.1)
-                    break
-                except queue.Full:
-                    continue
-
-        video.release()
+            
+            # Повтор передаётся без кадра: писатель повторит предыдущий результат
+            if self.duplicate_threshold is not None:
+                thumb = self.make_thumbnail(self.input_ring[slot])
+                if self.is_duplicate(thumb, reference):
+                    self.input_ring.release(slot)
+                    slot = None
+                    self.duplicate_frames += 1
+                else:
+                    reference = thumb
+            
+            if not self.put_item(self.read_queue, (i, slot)) and slot is not None:
+                self.input_ring.release(slot)
+        
+        frames.close()
         
         while not self.stop_event.is_set():
             try:
@@ -39,7 +236,16 @@ class VideoUpscaleWorker:
             except queue.Full:
                 continue
         
-    def processor_thread(self):
+    def put_item(self, target:queue.Queue, item) -> bool:
+        while not self.stop_event.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def processor_thread(self, upscaler, tile_cache):
         while not self.stop_event.is_set():
             try:
                 item = self.read_queue.get(timeout=0.1)
@@ -47,91 +253,214 @@ class VideoUpscaleWorker:
                 continue
             
             if item is None:
-                while not self.stop_event.is_set():
-                    try:
-                        self.write_queue.put(None, timeout=0.1)
-                        break
-                    except queue.Full:
-                        continue
+                self.put_item(self.read_queue, None) # Сигнал завершения для остальных обработчиков
                 break
             
-            i, frame = item
-            try:
-                upscaled_frame = self.upscaler.process_image(frame, check_interrupt=self.stop_event.is_set)
-                
-                while not self.stop_event.is_set():
-                    try:
-                        self.write_queue.put((i, upscaled_frame), timeout=0.1)
-                        break
-                    except queue.Full:
-                        continue
-            except Exception as e:
-                logging.error(f'Error processing frame {i}: {e}')
+            i, slot = item
+            
+            # Слот результата берётся только для кадров внутри окна перестановки: слотов в output_ring
+            # хватает на всё окно и последний записанный кадр, поэтому ожидание слота не блокирует писателя
+            with self.order_condition:
+                while i >= self.next_frame + self.reorder_window and not self.stop_event.is_set():
+                    self.order_condition.wait(0.1)
+            
+            out_slot = None
+            if slot is not None:
+                out_slot = self.output_ring.acquire(self.stop_event)
+                if out_slot is None:
+                    self.input_ring.release(slot)
+                    break
+                try:
+                    upscaler.process_image(self.input_ring[slot], check_interrupt=self.stop_event.is_set, reuse=tile_cache,
+                                           out=self.output_ring[out_slot])
+                except InterruptedError:
+                    # Отмена могла прийти через Upscaler.cancel, минуя stop_event: остальные потоки тоже должны встать
+                    self.stop_event.set()
+                    break
+                except Exception as e:
+                    # Кадр заменяется предыдущим, чтобы не нарушить порядок и число кадров
+                    logging.error(f'Error processing frame {i}: {e}')
+                    self.output_ring.release(out_slot)
+                    out_slot = None
+                finally:
+                    self.input_ring.release(slot)
+            
+            if not self.put_item(self.write_queue, (i, out_slot)) and out_slot is not None:
+                self.output_ring.release(out_slot)
+        
+        self.put_item(self.write_queue, None)
             
     def writer_thread(self, process, total_frames, progress):
         frames_written = 0
+        last_slot = None # Слот последнего записанного кадра, повторы и ошибочные кадры записываются из него
+        pending = {} # Буфер перестановки: кадры, пришедшие раньше предыдущих
+        finished_workers = 0
         try:
-            while not self.stop_event.is_set():
+            while not self.stop_event.is_set() and finished_workers < self.active_workers:
                 try:
                     item = self.write_queue.get(timeout=0.1)
                 except queue.Empty:
                     continue
                 
                 if item is None:
-                    break
+                    finished_workers += 1
+                    continue
                 
-                _, frame = item
+                i, slot = item
+                pending[i] = slot
                 
-                try:
-                    process.stdin.write(frame.tobytes())
-                    process.stdin.flush()
-                    frames_written += 1
-
-                    if progress and total_frames > 0:
-                        percent = int((frames_written / total_frames) * 100)
+                while self.next_frame in pending and not self.stop_event.is_set():
+                    slot = pending.pop(self.next_frame)
+                    with self.order_condition:
+                        self.next_frame += 1
+                        self.order_condition.notify_all()
+                    
+                    if slot is None:
+                        slot = last_slot
+                    elif last_slot is not None:
+                        self.output_ring.release(last_slot)
+                    if slot is None:
+                        continue # Первый кадр не удалось обработать, повторять нечего
+                    last_slot = slot
+                    
+                    try:
+                        self.queue_fill += self.write_queue.qsize() / self.write_queue.maxsize
+                        self.queue_samples += 1
+                        start = time.perf_counter()
+                        # Слот уходит в pipe без копирования в bytes
+                        process.stdin.write(self.output_ring.view(slot))
+                        process.stdin.flush()
+                        self.encoder_wait += time.perf_counter() - start
+                        frames_written += 1
+                        self.fps = frames_written / (time.perf_counter() - self.started)
                         
-                        if progress(percent) is False:
-                            self.stop_event.set()
-                except (BrokenPipeError, IOError) as e:
-                    logging.error(f'FFmpeg process ended unexpectedly: {e}')
-                    self.stop_event.set()
-                    break
+                        if progress and total_frames > 0:
+                            percent = int((frames_written / total_frames) * 100)
+                            
+                            if progress(percent) is False:
+                                self.stop_event.set()
+                    except (BrokenPipeError, IOError) as e:
+                        logging.error(f'FFmpeg process ended unexpectedly: {e}')
+                        self.stop_event.set()
+                        break
+            
+            if pending and not self.stop_event.is_set():
+                logging.error(f'{len(pending)} frames were not written, missing frame {self.next_frame}')
         finally:
             if process.stdin:
                 process.stdin.close()
                 
-    def process_video(self, input_path, output_path, work_dir, progress=None):
+    def report_encoder(self, encoder:EncoderProgress, elapsed:float):
+        """
+        Логирует замеры энкодера за видео и передаёт их в подбор настроек для следующей части.
+        """
+        tuner = self.encoder_tuner
+        busy = self.encoder_wait / elapsed if elapsed > 0 else 0.0
+        queue_fill = self.queue_fill / self.queue_samples if self.queue_samples else 0.0
+        logging.info(f'Encoder: preset {tuner.preset}, {tuner.threads or "auto"} threads, {encoder.fps:.1f} fps, '
+                     f'waited for encoder {busy:.0%} of time, write queue {queue_fill:.0%} full')
+        
+        settings = (tuner.preset, tuner.threads)
+        tuner.update(busy, queue_fill)
+        if (tuner.preset, tuner.threads) != settings:
+            logging.info(f'Encoder settings for next part: preset {tuner.preset}, {tuner.threads or "auto"} threads')
+    
+    def process_video(self, input_path, output_path, work_dir, progress=None, meta=None, segment=None):
+        """
+        Увеличивает видео (или его часть) и кодирует результат в output_path.
+        Возвращает False, если обработка остановлена или FFmpeg завершился с ошибкой.
+        - meta: параметры видео от probe_video, если уже известны.
+        - segment: часть видео {'start': время начала в секундах (ключевой кадр), 'frames': число кадров}.
+          Часть кодируется без звука, звук добавляется при склейке.
+        """
         self.stop_event.clear()
+        self.duplicate_frames = 0
+        self.encoder_wait = 0.0
+        self.queue_fill = 0.0
+        self.queue_samples = 0
+        self.next_frame = 1
+        self.fps = 0.0
+        self.started = time.perf_counter()
         
+        meta = meta or probe_video(input_path)
+        if meta:
+            total_frames = segment['frames'] if segment else meta['frames']
+            fps = meta['fps']
+            source_w, source_h = meta['width'], meta['height']
+            logging.info(f'Video: {meta["width"]}x{meta["height"]}, {total_frames} frames, {meta["pix_fmt"]}, rotation {meta["rotation"]}')
+        else:
+            logging.warning('ffprobe is unavailable, falling back to OpenCV decoder')
+            video = cv2.VideoCapture(input_path)
+            total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+            fps = video.get(cv2.CAP_PROP_FPS)
+            source_w = int(video.get(cv2.CAP_PROP_FRAME_WIDTH))
+            source_h = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT))
+            video.release()
         
-        video = cv2.VideoCapture(input_path)
-        total_frames = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
-        fps = video.get(cv2.CAP_PROP_FPS)
-        w = int(video.get(cv2.CAP_PROP_FRAME_WIDTH)) * self.upscaler.scale
-        h = int(video.get(cv2.CAP_PROP_FRAME_HEIGHT)) * self.upscaler.scale
-        video.release()
+        scale = self.upscaler.scale
+        output_size = None
+        self.frame_size = (source_w, source_h)
+        if self.target_size:
+            target = plan_for_scale(source_w, source_h, get_target_size(source_w, source_h, self.target_size), scale)
+            self.frame_size, output_size = target['input'], target['output']
+            logging.info(f'Target size {output_size[0]}x{output_size[1]}: model input {self.frame_size[0]}x{self.frame_size[1]}, '
+                         f'x{scale}, resize {target["post_upscale"]:.2f}')
+        w, h = self.frame_size[0] * scale, self.frame_size[1] * scale
         
-        logging.info(f'Starting pipeline. Output: {w}x{h}, {fps} fps')
-        ffmpeg_process = start_ffmpeg_process(output_path, fps, w, h, input_source=input_path)
+        plan = self.governor.plan_video(w // scale, h // scale, scale, self.workers, self.upscaler.provider, self.tile_reuse)
+        self.read_queue = queue.Queue(maxsize=plan['read_queue'])
+        self.write_queue = queue.Queue(maxsize=plan['write_queue'])
+        self.active_workers = plan['workers']
+        self.reorder_window = self.write_queue.maxsize + self.active_workers
+        # Предел памяти на тайлы действует только на это видео, общий Upscaler не меняется
+        upscaler = self.upscaler.with_memory_limit(plan['inference']) if plan['inference'] else self.upscaler
+        upscalers = self.create_upscalers(upscaler, self.active_workers)
+        self.tile_caches = [TileReuseCache(self.refresh_interval) if self.tile_reuse else None for _ in upscalers]
+        
+        # Кольца кадров учитываются в бюджете до их выделения: если память занята другими файлами,
+        # видео ждёт её освобождения, как и чтение изображений в ImageBatchWorker
+        ring_bytes = (h // scale) * (w // scale) * 3 * (self.read_queue.maxsize + self.active_workers + 2) + h * w * 3 * (self.reorder_window + 2)
+        if not self.governor.reserve(ring_bytes, self.stop_event):
+            logging.info('Video processing was stopped by user.')
+            return False
+        
+        tuner = self.encoder_tuner
+        preset, encoder_threads = tuner.preset, tuner.threads
+        logging.info(f'Starting pipeline. Output: {w}x{h}, {fps} fps, x264 preset {preset}, {encoder_threads or "auto"} encoder threads')
+        ffmpeg_process = start_ffmpeg_process(output_path, fps, w, h, input_source=None if segment else input_path,
+                                              preset=preset, threads=encoder_threads, output_size=output_size)
         
         if ffmpeg_process is None:
             logging.error('Failed to start FFmpeg process.')
+            self.governor.release(ring_bytes)
             return False
-            
+        
+        encoder = EncoderProgress(ffmpeg_process)
+        started = time.perf_counter()
+        
         try:
-            thread_reader = threading.Thread(target=self.reader_thread, args=(input_path,))
-            thread_processor = threading.Thread(target=self.processor_thread)
+            self.input_ring = FrameRing((h // scale, w // scale, 3), self.read_queue.maxsize + self.active_workers + 2)
+            self.output_ring = FrameRing((h, w, 3), self.reorder_window + 2)
+            
+            thread_reader = threading.Thread(target=self.reader_thread, args=(input_path, meta, segment))
+            threads_processor = [
+                threading.Thread(target=self.processor_thread, args=(upscaler, tile_cache))
+                for upscaler, tile_cache in zip(upscalers, self.tile_caches)
+            ]
             thread_writer = threading.Thread(target=self.writer_thread, args=(ffmpeg_process, total_frames, progress))
             
             thread_reader.start()
-            thread_processor.start()
+            for thread in threads_processor:
+                thread.start()
             thread_writer.start()
             
             thread_reader.join()
-            thread_processor.join()
+            for thread in threads_processor:
+                thread.join()
             thread_writer.join()
             
-            stdout, stderr = ffmpeg_process.communicate()
+            ffmpeg_process.wait()
+            encoder.join()
             
             if self.stop_event.is_set():
                 logging.info('Video processing was stopped by user.')
@@ -141,7 +470,16 @@ class VideoUpscaleWorker:
                 logging.error(f'FFmpeg exited with error code {ffmpeg_process.returncode}')
                 return False
             
-            logging.info('Video processing completed successfully.')
+            logging.info(f'Video processing completed successfully, {self.fps:.2f} fps.')
+            self.report_encoder(encoder, time.perf_counter() - started)
+            if total_frames > 0:
+                logging.info(f'Duplicate frames: {self.duplicate_frames} of {total_frames} ({self.duplicate_frames / total_frames:.0%}) reused without inference')
+            reused_tiles = sum(cache.reused_tiles for cache in self.tile_caches if cache)
+            total_tiles = sum(cache.total_tiles for cache in self.tile_caches if cache)
+            if total_tiles > 0:
+                logging.info(f'Tile reuse: {reused_tiles} of {total_tiles} tiles ({reused_tiles / total_tiles:.0%}) copied from previous frame')
+                flat_tiles = sum(cache.flat_tiles for cache in self.tile_caches if cache)
+                logging.info(f'Flat tiles: {flat_tiles} of {total_tiles} tiles ({flat_tiles / total_tiles:.0%}) upscaled by interpolation')
             return True
             
         except Exception as e:
@@ -150,4 +488,10 @@ class VideoUpscaleWorker:
             
             if ffmpeg_process:
                 ffmpeg_process.kill()
-            raise e
\ No newline at end of file
+            raise e
+        finally:
+            for ring in (self.input_ring, self.output_ring):
+                if ring:
+                    ring.close()
+            self.input_ring = self.output_ring = None
+            self.governor.release(ring_bytes)
\ No newline at end of file
@@ -4,14 +4,17 @@ import shutil
 import tempfile
 from PySide6.QtWidgets import QWidget, QMainWindow, QVBoxLayout, QHBoxLayout, QPushButton, QLabel, \
     QComboBox, QFileDialog, QProgressBar, QListWidget, QListWidgetItem, QCheckBox, QGroupBox, \
-    QTabWidget, QStyle, QPlainTextEdit
+    QTabWidget, QStyle, QPlainTextEdit, QSpinBox
 from PySide6.QtCore import Qt
 from PySide6.QtGui import QPixmap
 from neural_upscaler.config import ConfigManager
-from neural_upscaler.gui.utils.worker import UpscaleWorker
+from neural_upscaler.gui.utils.worker import UpscaleWorker, resolve_model, create_upscaler
+from neural_upscaler.engine.upscaler import start_warmup
+from neural_upscaler.engine.planning import TARGET_SIZES
 from neural_upscaler.gui.widgets.comparison import ComparisonWidget
 from neural_upscaler.gui.utils.log_handler import QtLogHandler
 from neural_upscaler.utils.system import get_gpu_info, check_ffmpeg
+from neural_upscaler.utils.paths import get_cache_dir
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -40,6 +43,28 @@ class MainWindow(QMainWindow):
         log_handler.setFormatter(formatter)
         
         logging.getLogger().addHandler(log_handler)
+        
+        self.warmup_model()
+        self.combo_model.currentTextChanged.connect(self.warmup_model)
+        self.combo_quality.currentIndexChanged.connect(self.warmup_model)
+        self.spin_sessions.editingFinished.connect(self.warmup_model)
+    
+    def warmup_model(self):
+        """
+        Загружает выбранную модель в фоне, пока пользователь добавляет файлы. Модель создаётся с теми же настройками,
+        что и при обработке (см. create_upscaler), а выбор модели и автоподбор тоже выполняются в фоне.
+        """
+        if not self.check_warmup.isChecked():
+            return
+        
+        model_choice = self.combo_model.currentText()
+        quality = self.combo_quality.currentData()
+        parallel_sessions = self.spin_sessions.value()
+        autotune_cache = None
+        if self.check_autotune.isChecked():
+            autotune_cache = os.path.join(self.config_manager.config_dir, 'autotune.json')
+        
+        start_warmup(lambda: create_upscaler(resolve_model(model_choice, quality), autotune_cache, parallel_sessions, allow_benchmark=False))
     
     def setup_ui(self):
         self.setWindowTitle('Neural Upscaler')
@@ -106,11 +131,69 @@ class MainWindow(QMainWindow):
         self.combo_model.addItems(['x2', 'x4'])
         params_layout.addWidget(self.combo_model)
         
+        params_layout.addWidget(QLabel('Размер результата:'))
+        self.combo_target = QComboBox()
+        self.combo_target.addItem('Масштаб модели', None)
+        for name, size in TARGET_SIZES.items():
+            self.combo_target.addItem(name, size)
+        self.combo_target.setToolTip('Модель и предварительное уменьшение подбираются под каждый файл так,\nчтобы получить нужный размер с наименьшими затратами.')
+        params_layout.addWidget(self.combo_target)
+        
+        params_layout.addWidget(QLabel('Качество:'))
+        self.combo_quality = QComboBox()
+        self.combo_quality.addItem('Максимальное', 'max')
+        self.combo_quality.addItem('Быстрое (INT8 на CPU)', 'fast')
+        params_layout.addWidget(self.combo_quality)
+        
         params_layout.addWidget(QLabel('Формат сохранения:'))
         self.combo_format = QComboBox()
         self.combo_format.addItems(['Auto', 'PNG', 'JPG', 'WEBP'])
         params_layout.addWidget(self.combo_format)
         
+        params_layout.addWidget(QLabel('Сжатие результата:'))
+        self.combo_encode = QComboBox()
+        self.combo_encode.addItem('Быстрое', 'fast')
+        self.combo_encode.addItem('Сбалансированное', 'balanced')
+        self.combo_encode.addItem('Минимальный размер', 'smallest')
+        self.combo_encode.setCurrentIndex(1)
+        self.combo_encode.setToolTip('Для видео задаёт пределы пресетов x264. Кодирование начинается с самого экономного пресета\n'
+                                     'и ускоряется, если не успевает за нейросетью (между частями видео или файлами).')
+        params_layout.addWidget(self.combo_encode)
+        
+        self.check_autotune = QCheckBox('Автоподбор параметров (замер при первом запуске)')
+        params_layout.addWidget(self.check_autotune)
+        
+        self.check_warmup = QCheckBox('Предзагружать модель при запуске')
+        self.check_warmup.setChecked(True)
+        params_layout.addWidget(self.check_warmup)
+        
+        params_layout.addWidget(QLabel('Параллельных сессий (CPU):'))
+        self.spin_sessions = QSpinBox()
+        self.spin_sessions.setRange(1, 16)
+        params_layout.addWidget(self.spin_sessions)
+        
+        params_layout.addWidget(QLabel('Бюджет памяти, ГБ (0 - авто):'))
+        self.spin_memory_budget = QSpinBox()
+        self.spin_memory_budget.setRange(0, 256)
+        self.spin_memory_budget.setToolTip('Предел памяти на очереди кадров, обработчики видео и тайлы нейросети на CPU.\n'
+                                           'Больше него изображение обрабатывается полосами. 0 - по свободной памяти.')
+        params_layout.addWidget(self.spin_memory_budget)
+        
+        params_layout.addWidget(QLabel('Параллельных кадров (видео):'))
+        self.spin_video_workers = QSpinBox()
+        self.spin_video_workers.setRange(1, 8)
+        params_layout.addWidget(self.spin_video_workers)
+        
+        params_layout.addWidget(QLabel('Процессов для видео (частями):'))
+        self.spin_video_processes = QSpinBox()
+        self.spin_video_processes.setRange(1, 8)
+        self.spin_video_processes.setToolTip('Длинное видео делится на части, каждую обрабатывает свой процесс.\nНа видеокарте держите 1-2: каждый процесс загружает свою копию модели.')
+        params_layout.addWidget(self.spin_video_processes)
+        
+        self.check_video_resume = QCheckBox('Продолжать прерванную обработку видео')
+        self.check_video_resume.setToolTip('Видео сохраняется готовыми частями. Повторный запуск того же файла\nс той же моделью продолжит с последней готовой части.')
+        params_layout.addWidget(self.check_video_resume)
+        
         self.params_group.setLayout(params_layout)
         layout.addWidget(self.params_group)
 
@@ -310,7 +393,17 @@ class MainWindow(QMainWindow):
         
         model_choice = self.combo_model.currentText()
         
-        self.worker = UpscaleWorker(files_to_process, model_choice, self.temp_output_path, save_format, self.work_dir)
+        autotune_cache = None
+        if self.check_autotune.isChecked():
+            autotune_cache = os.path.join(self.config_manager.config_dir, 'autotune.json')
+        
+        self.worker = UpscaleWorker(files_to_process, model_choice, self.temp_output_path, save_format, self.work_dir, autotune_cache,
+                                    self.spin_sessions.value(), self.combo_quality.currentData(),
+                                    memory_budget=self.spin_memory_budget.value() * 1024**3 or None,
+                                    encode_profile=self.combo_encode.currentData(), video_workers=self.spin_video_workers.value(),
+                                    video_processes=self.spin_video_processes.value(),
+                                    video_jobs_dir=get_cache_dir('video_jobs') if self.check_video_resume.isChecked() else None,
+                                    target_size=self.combo_target.currentData())
         
         self.worker.log_signal.connect(self.update_status)
         self.worker.finished_signal.connect(self.process_finished)
@@ -383,7 +476,17 @@ class MainWindow(QMainWindow):
                 os.remove(self.temp_output_path)
         
         self.settings['model'] = self.combo_model.currentText()
+        self.settings['target_size'] = self.combo_target.currentData()
         self.settings['format'] = self.combo_format.currentText()
+        self.settings['autotune'] = self.check_autotune.isChecked()
+        self.settings['warmup'] = self.check_warmup.isChecked()
+        self.settings['parallel_sessions'] = self.spin_sessions.value()
+        self.settings['quality'] = self.combo_quality.currentData()
+        self.settings['encode_profile'] = self.combo_encode.currentData()
+        self.settings['memory_budget_gb'] = self.spin_memory_budget.value()
+        self.settings['video_workers'] = self.spin_video_workers.value()
+        self.settings['video_processes'] = self.spin_video_processes.value()
+        self.settings['video_resume'] = self.check_video_resume.isChecked()
         self.config_manager.save_config(self.settings)
         
         self.cleanup_temp()
@@ -431,8 +534,28 @@ class MainWindow(QMainWindow):
     def apply_settings(self):
         if 'model' in self.settings:
             self.combo_model.setCurrentText(self.settings['model'])
+        if 'target_size' in self.settings:
+            self.combo_target.setCurrentIndex(max(0, self.combo_target.findData(self.settings['target_size'])))
         if 'format' in self.settings:
             self.combo_format.setCurrentText(self.settings['format'])
+        if 'autotune' in self.settings:
+            self.check_autotune.setChecked(self.settings['autotune'])
+        if 'warmup' in self.settings:
+            self.check_warmup.setChecked(self.settings['warmup'])
+        if 'parallel_sessions' in self.settings:
+            self.spin_sessions.setValue(self.settings['parallel_sessions'])
+        if 'quality' in self.settings:
+            self.combo_quality.setCurrentIndex(max(0, self.combo_quality.findData(self.settings['quality'])))
+        if 'encode_profile' in self.settings:
+            self.combo_encode.setCurrentIndex(max(0, self.combo_encode.findData(self.settings['encode_profile'])))
+        if 'memory_budget_gb' in self.settings:
+            self.spin_memory_budget.setValue(self.settings['memory_budget_gb'])
+        if 'video_workers' in self.settings:
+            self.spin_video_workers.setValue(self.settings['video_workers'])
+        if 'video_processes' in self.settings:
+            self.spin_video_processes.setValue(self.settings['video_processes'])
+        if 'video_resume' in self.settings:
+            self.check_video_resume.setChecked(self.settings['video_resume'])
             
     def append_log_html(self, text):
         """
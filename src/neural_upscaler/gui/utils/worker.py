@@ -1,10 +1,63 @@
 import logging
 import os
+import time
 from PySide6.QtCore import QThread, Signal
-from neural_upscaler.utils.paths import get_resource_path
-from neural_upscaler.engine.upscaler import Upscaler
-from neural_upscaler.engine.video_processor import VideoUpscaleWorker
-from neural_upscaler.utils.file_io import read_image, save_image
+from neural_upscaler.utils.paths import get_resource_path, get_cache_dir
+from neural_upscaler.engine.upscaler import Upscaler, get_providers_list
+from neural_upscaler.engine import models
+from neural_upscaler.engine.autotune import get_tuning
+from neural_upscaler.engine.video_processor import VideoUpscaleWorker, EncoderTuner, get_encoder_threads
+from neural_upscaler.engine.ffmpeg_wrapper import X264_PRESET_RANGES, probe_video
+from neural_upscaler.engine.segments import SegmentedVideoWorker
+from neural_upscaler.engine.image_batch import ImageBatchWorker
+from neural_upscaler.engine.large_image import process_large_image, needs_out_of_core, get_memory_budget
+from neural_upscaler.engine.memory import MemoryGovernor
+from neural_upscaler.engine.planning import get_target_size, get_model_costs, plan_target, format_cost
+from neural_upscaler.utils.file_io import read_image_size
+
+STATUS_INTERVAL = 0.5 # Как часто (в секундах) обновлять строку состояния скоростью и оставшимся временем
+
+def format_eta(seconds):
+    """
+    Оставшееся время для строки состояния: м:сс или ч:мм:сс.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+def resolve_model(model_choice, quality='max'):
+    """
+    Возвращает вариант модели из манифеста по выбору в интерфейсе ('x2' или 'x4') для текущего провайдера.
+    """
+    weights_dir = get_resource_path('resources/weights')
+    return models.resolve_model(weights_dir, model_choice, get_providers_list()[0], quality)
+
+def create_upscaler(variant, autotune_cache=None, parallel_sessions=1, allow_benchmark=True):
+    """
+    Создаёт Upscaler для варианта модели с настройками интерфейса. Обработка и предзагрузка создают его одинаково,
+    поэтому предзагрузка попадает в те же сессии реестра.
+    - autotune_cache: файл кэша автоподбора. None - без автоподбора.
+    - allow_benchmark: замерять параметры, если их нет в кэше (см. get_tuning).
+    """
+    tuning = get_tuning(variant['path'], variant['scale'], autotune_cache, allow_benchmark) if autotune_cache else None
+    return Upscaler(model_path=variant['path'], scale=variant['scale'], batch_size=None, tuning=tuning, cache_dir=get_cache_dir('models'),
+                    parallel_sessions=parallel_sessions, tile_align=variant['tile_align'])
+
+def load_variants(quality='max'):
+    """
+    Варианты моделей всех доступных масштабов для текущего провайдера: {масштаб: вариант}.
+    """
+    weights_dir = get_resource_path('resources/weights')
+    provider = get_providers_list()[0]
+    manifest = models.load_manifest(weights_dir)
+    
+    variants = {}
+    for scale in sorted({variant['scale'] for variant in manifest}):
+        try:
+            variants[scale] = models.resolve_variant(manifest, scale, provider, quality)
+        except FileNotFoundError:
+            continue
+    return variants
 
 class UpscaleWorker(QThread):
     finished_signal = Signal()
@@ -12,33 +65,120 @@ class UpscaleWorker(QThread):
     progress_signal = Signal(int)
     stopped_signal = Signal()
     
-    def __init__(self, input_files, model_choice, output_path, save_format, work_dir):
+    def __init__(self, input_files, model_choice, output_path, save_format, work_dir, autotune_cache=None, parallel_sessions=1, quality='max', memory_budget=None, encode_profile='balanced', video_workers=1, video_processes=1, video_jobs_dir=None, target_size=None):
+        """
+        - autotune_cache: путь к файлу результатов автоподбора параметров. None - автоподбор выключен.
+        - parallel_sessions: количество сессий для параллельной обработки тайлов на CPU.
+        - quality: 'max' или 'fast' (INT8 модель на CPU).
+        - encode_profile: профиль кодирования результата ('fast', 'balanced', 'smallest').
+        - video_workers: количество потоков, параллельно обрабатывающих кадры видео.
+        - video_processes: количество процессов, обрабатывающих длинное видео частями. 1 - без деления на части.
+        - video_jobs_dir: папка возобновляемых заданий для видео (см. SegmentedVideoWorker). None - без контрольных точек.
+        - memory_budget: бюджет памяти в байтах: больше него изображение обрабатывается полосами, в него же укладываются
+          очереди и тайлы видео и пачки изображений (см. MemoryGovernor). None - по свободной памяти, тогда размер тайла
+          подбирает сам Upscaler, а бюджет ограничивает только буферы.
+        - target_size: меньшая сторона результата (1080, 2160 и т.п.). Модель и путь к размеру выбираются под каждый файл
+          (см. plan_target), model_choice остаётся для файлов, размер которых не удалось узнать. None - масштаб модели.
+        """
         super().__init__()
         self.input_files = input_files
         self.model_choice = model_choice
         self.output_path = output_path
         self.save_format = save_format
         self.work_dir = work_dir
+        self.autotune_cache = autotune_cache
+        self.parallel_sessions = parallel_sessions
+        self.quality = quality
+        self.memory_budget = memory_budget
+        self.encode_profile = encode_profile
+        self.video_workers = video_workers
+        self.video_processes = video_processes
+        self.video_jobs_dir = video_jobs_dir
+        self.target_size = target_size
         
+        self.upscalers = {} # Загруженные модели по масштабу
+        self.file_status = '' # Строка состояния текущего файла, к ней добавляются скорость и оставшееся время
+        self.file_started = 0.0
+        self.status_time = 0.0
+        self.variants = {}
+        self.costs = {}
         self.current_pipeline = None
     
+    def start_file(self, text):
+        self.file_status = text
+        self.file_started = time.perf_counter()
+        self.status_time = 0.0
+        self.log_signal.emit(text)
+    
+    def emit_status(self, text):
+        """
+        Обновляет строку состояния не чаще STATUS_INTERVAL, чтобы не заваливать интерфейс сигналами.
+        """
+        now = time.perf_counter()
+        if now - self.status_time >= STATUS_INTERVAL:
+            self.status_time = now
+            self.log_signal.emit(f'{self.file_status} - {text}')
+    
     def report_progress(self, percent):
         self.progress_signal.emit(percent)
+        
+        # Скорость видео в кадрах в секунду, оставшееся время - по доле готовых кадров
+        fps = getattr(self.current_pipeline, 'fps', 0.0)
+        if fps > 0 and 0 < percent < 100:
+            elapsed = time.perf_counter() - self.file_started
+            self.emit_status(f'{percent}%, {fps:.1f} кадр/с, осталось {format_eta(elapsed * (100 - percent) / percent)}')
+        
         if self.isInterruptionRequested():
             return False
         return True
+    
+    def report_tiles(self, done, total, eta, progress=True):
+        """
+        Ход обработки изображения по тайлам (см. TileProgress).
+        - progress: двигать полосу прогресса. Для пачки изображений она показывает готовые файлы.
+        """
+        if progress:
+            self.progress_signal.emit(int(done / total * 100))
+        if done < total:
+            self.emit_status(f'тайлы {done} из {total}' + (f', осталось {format_eta(eta)}' if eta is not None else ''))
+    
+    def get_upscaler(self, variant):
+        """
+        Возвращает Upscaler для варианта модели, загружая его при первом обращении.
+        """
+        scale = variant['scale']
+        if scale not in self.upscalers:
+            if self.autotune_cache:
+                self.log_signal.emit('Подбор параметров производительности...')
+            self.upscalers[scale] = create_upscaler(variant, self.autotune_cache, self.parallel_sessions)
+        return self.upscalers[scale]
+    
+    def select_upscaler(self, default, size, frames=1):
+        """
+        В режиме целевого размера выбирает модель с самым дешёвым путём к размеру (см. plan_target)
+        и сообщает план и оценку стоимости до начала обработки.
+        - size: (ширина, высота) файла. None - размер неизвестен, остаётся выбранная модель.
+        - frames: число кадров видео для оценки стоимости.
+        """
+        if not self.target_size or not size:
+            return default
+        
+        width, height = size
+        plan = plan_target(width, height, get_target_size(width, height, self.target_size), self.costs)
+        (input_w, input_h), (output_w, output_h) = plan['input'], plan['output']
+        logging.info(f'Target plan: x{plan["scale"]}, input {input_w}x{input_h}, output {output_w}x{output_h}, cost {format_cost(plan, frames)}')
+        self.log_signal.emit(f'План: модель x{plan["scale"]}, вход {input_w}x{input_h}, результат {output_w}x{output_h}, '
+                             f'оценка {format_cost(plan, frames)}')
+        return self.get_upscaler(self.variants[plan['scale']])
         
     def run(self):
         self.log_signal.emit('Загрузка нейросети...')
         
-        if self.model_choice == 'x2':
-            model_path = get_resource_path('resources/weights/RealESRGAN_x2plus_fp16.onnx')
-            scale = 2
-        else:
-            model_path = get_resource_path('resources/weights/RealESRGAN_x4plus_fp16.onnx')
-            scale = 4
         try:
-            upscaler = Upscaler(model_path=model_path, scale=scale)
+            upscaler = self.get_upscaler(resolve_model(self.model_choice, self.quality))
+            if self.target_size:
+                self.variants = load_variants(self.quality)
+                self.costs = get_model_costs(self.variants, upscaler.provider)
         except Exception as e:
             self.log_signal.emit(f'Ошибка загрузки нейросети: {e}')
             logging.error(f'Error loading model: {e}')
@@ -47,7 +187,12 @@ class UpscaleWorker(QThread):
             
         self.log_signal.emit('Обработка...')
         
+        # Настройки энкодера подбираются по ходу и переходят от видео к видео
+        encoder_tuner = EncoderTuner(*X264_PRESET_RANGES[self.encode_profile], threads=get_encoder_threads(upscaler))
+        governor = MemoryGovernor(self.memory_budget)
+        
         total_files = len(self.input_files)
+        image_jobs = {} # Обычные изображения обрабатываются общим конвейером после остальных файлов, по моделям
         
         for i, file_path in enumerate(self.input_files):
             if self.isInterruptionRequested():
@@ -58,10 +203,6 @@ class UpscaleWorker(QThread):
             file_name_full = os.path.basename(file_path)
             file_name_only = os.path.splitext(file_name_full)[0]
             src_ext = os.path.splitext(file_name_full)[1].lower()
-                                
-            self.log_signal.emit(f'Файл {i + 1} из {total_files}: {file_name_full}')
-            
-            self.progress_signal.emit(0)
             
             if self.save_format == 'Auto':
                 ext = src_ext
@@ -87,18 +228,35 @@ class UpscaleWorker(QThread):
                 if os.path.splitext(current_file_output)[1].lower() not in ['.mp4', '.avi', '.mov', '.mkv', '.webm']:
                     current_file_output = os.path.splitext(current_file_output)[0] + '.mp4'
                 
-                self.current_pipeline = VideoUpscaleWorker(upscaler)
+                self.start_file(f'Файл {i + 1} из {total_files}: {file_name_full}')
+                self.progress_signal.emit(0)
                 
                 try:
+                    # Видео читается ffprobe один раз: при обработке частями кадры считаются вместе с ключевыми кадрами
+                    segmented = self.video_processes > 1 or bool(self.video_jobs_dir)
+                    meta = probe_video(file_path, count_frames=not segmented)
+                    file_upscaler = self.select_upscaler(upscaler, (meta['width'], meta['height']) if meta else None,
+                                                         meta['frames'] if meta else 1)
+                    
+                    if segmented:
+                        self.current_pipeline = SegmentedVideoWorker(file_upscaler, self.video_processes, self.video_workers, self.video_jobs_dir,
+                                                                     encoder_tuner, governor, self.target_size)
+                    else:
+                        self.current_pipeline = VideoUpscaleWorker(file_upscaler, workers=self.video_workers, encoder_tuner=encoder_tuner,
+                                                                   governor=governor, target_size=self.target_size)
+                    
                     run = self.current_pipeline.process_video(
                         input_path=file_path, 
                         output_path=current_file_output, 
                         work_dir=self.work_dir, 
-                        progress=self.report_progress
+                        progress=self.report_progress,
+                        meta=meta
                     )
                     
                     if run is False:
                         self.log_signal.emit('Обработка видео была остановлена пользователем.')
+                        if self.video_jobs_dir:
+                            self.log_signal.emit('Готовые части сохранены, повторный запуск продолжит обработку.')
                         break
                 except Exception as e:
                     self.log_signal.emit(f'Ошибка при обработке видео: {e}')
@@ -107,24 +265,42 @@ class UpscaleWorker(QThread):
                 self.current_pipeline = None
                 
             elif src_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.webp']:
+                budget = self.memory_budget or get_memory_budget()
+                size = read_image_size(file_path)
+                
                 try:
-                    img = read_image(file_path)
-                    if img is not None:
-                        try:
-                            res = upscaler.process_image(img, check_interrupt=self.isInterruptionRequested)
-                            save_image(current_file_output, res)
-                        except InterruptedError:
-                            self.log_signal.emit('Обработка изображения была остановлена пользователем.')
-                            break
-                        
-                        self.progress_signal.emit(100)
-                    else:
-                        self.log_signal.emit(f'Не удалось прочитать изображение: {file_path}')
-                        logging.error(f'Failed to read image: {file_path}')
+                    file_upscaler = self.select_upscaler(upscaler, size[::-1] if size else None)
                 except Exception as e:
-                    self.log_signal.emit(f'Ошибка при обработке изображения: {e}')
-                    logging.error(f'Error processing image {file_path}: {e}')                
-                        
+                    self.log_signal.emit(f'Ошибка загрузки нейросети: {e}')
+                    logging.error(f'Error loading model: {e}')
+                    continue
+                
+                # В режиме целевого размера результат обычно меньше, чем в масштабе модели, поэтому оценка с запасом
+                if size and needs_out_of_core(*size, file_upscaler.scale, budget):
+                    self.progress_signal.emit(0)
+                    self.start_file(f'Файл {i + 1} из {total_files}: {file_name_full} (большое изображение, обработка полосами)')
+                    target = get_target_size(size[1], size[0], self.target_size) if self.target_size else None
+                    try:
+                        if not process_large_image(file_upscaler, file_path, current_file_output, self.work_dir, budget,
+                                                   check_interrupt=self.isInterruptionRequested, progress=self.progress_signal.emit,
+                                                   encode_profile=self.encode_profile, size=target):
+                            self.log_signal.emit(f'Не удалось прочитать изображение: {file_path}')
+                            logging.error(f'Failed to read image: {file_path}')
+                    except InterruptedError:
+                        self.log_signal.emit('Обработка изображения была остановлена пользователем.')
+                        break
+                    except Exception as e:
+                        self.log_signal.emit(f'Ошибка при обработке изображения: {e}')
+                        logging.error(f'Error processing image {file_path}: {e}')
+                    continue
+                
+                image_jobs.setdefault(file_upscaler.scale, []).append((file_path, current_file_output))
+        
+        for scale, jobs in image_jobs.items():
+            if self.isInterruptionRequested():
+                break
+            self.process_images(self.upscalers[scale], jobs, governor)
+        
         if self.isInterruptionRequested():
             self.log_signal.emit('Обработка остановлена пользователем.')
             self.stopped_signal.emit()
@@ -133,7 +309,37 @@ class UpscaleWorker(QThread):
             self.log_signal.emit('Готово! Все файлы обработаны.')
             self.finished_signal.emit()
     
+    def process_images(self, upscaler, jobs, governor=None):
+        """
+        Обрабатывает изображения конвейером: чтение следующих файлов и сохранение готовых идут параллельно с нейросетью.
+        """
+        total_images = len(jobs)
+        
+        def on_file(index, path):
+            self.start_file(f'Изображение {index} из {total_images}: {os.path.basename(path)}')
+        
+        def on_tiles(index, done, total, eta):
+            self.report_tiles(done, total, eta, progress=total_images == 1)
+        
+        self.progress_signal.emit(0)
+        self.current_pipeline = ImageBatchWorker(upscaler, encode_profile=self.encode_profile, governor=governor, target_size=self.target_size)
+        try:
+            if self.current_pipeline.process_images(jobs, progress=self.progress_signal.emit, on_file=on_file, on_tiles=on_tiles) is False:
+                self.log_signal.emit('Обработка изображений была остановлена пользователем.')
+            
+            for path in self.current_pipeline.failed:
+                self.log_signal.emit(f'Не удалось обработать изображение: {path}')
+        except Exception as e:
+            self.log_signal.emit(f'Ошибка при обработке изображений: {e}')
+            logging.error(f'Error processing images: {e}')
+        
+        self.current_pipeline = None
+    
     def requestInterruption(self):
         super().requestInterruption()
         if self.current_pipeline:
-            self.current_pipeline.stop_event.set()
\ No newline at end of file
+            self.current_pipeline.stop_event.set()
+        
+        # Идущие вызовы нейросети прерываются сразу, а не после текущего тайла
+        for upscaler in list(self.upscalers.values()):
+            upscaler.cancel()
\ No newline at end of file
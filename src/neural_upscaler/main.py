@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 import onnxruntime as ort
 import logging
 from logging.handlers import RotatingFileHandler
@@ -37,6 +38,8 @@ def setup_logging():
     )
 
 if __name__ == '__main__':
+    multiprocessing.freeze_support() # Процессы обработки видео частями в собранном exe
+    
     app = QApplication(sys.argv)
     app.setApplicationName('NeuralUpscaler')
     
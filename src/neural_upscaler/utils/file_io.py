@@ -1,21 +1,210 @@
 import cv2
 import os
+import zlib
+import struct
 import numpy as np
+import concurrent.futures
+from PySide6.QtGui import QImageReader
+from neural_upscaler.utils.system import get_cpu_threads
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PARALLEL_ENCODE_PIXELS = 4 * 1024 ** 2 # С какого размера PNG кодируется полосами в несколько потоков
+MAX_ENCODE_THREADS = 8
+
+# Профили кодирования результата: скорость против размера файла (замеры - dev_scripts/bench_encode.py).
+# OpenCV не даёт выбрать метод WEBP (скорость/размер), поэтому для WEBP профиль меняет только качество.
+ENCODE_PROFILES = {
+    'fast': {
+        'png': [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE, cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FILTER_SUB],
+        'jpeg': [cv2.IMWRITE_JPEG_QUALITY, 100],
+        'webp': [cv2.IMWRITE_WEBP_QUALITY, 100],
+        'zlib': (1, zlib.Z_RLE), # Для собственного кодера PNG (полосами и потоково)
+        'png_parallel': True,
+    },
+    'balanced': {
+        'png': [cv2.IMWRITE_PNG_COMPRESSION, 1, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_RLE, cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FILTER_PAETH],
+        'jpeg': [cv2.IMWRITE_JPEG_QUALITY, 100, cv2.IMWRITE_JPEG_OPTIMIZE, 1],
+        'webp': [cv2.IMWRITE_WEBP_QUALITY, 100],
+        'zlib': (1, zlib.Z_RLE),
+        'png_parallel': False,
+    },
+    'smallest': {
+        'png': [cv2.IMWRITE_PNG_COMPRESSION, 9, cv2.IMWRITE_PNG_STRATEGY, cv2.IMWRITE_PNG_STRATEGY_FILTERED, cv2.IMWRITE_PNG_FILTER, cv2.IMWRITE_PNG_FILTER_PAETH],
+        'jpeg': [cv2.IMWRITE_JPEG_QUALITY, 95, cv2.IMWRITE_JPEG_OPTIMIZE, 1, cv2.IMWRITE_JPEG_PROGRESSIVE, 1],
+        'webp': [cv2.IMWRITE_WEBP_QUALITY, 95],
+        'zlib': (9, zlib.Z_FILTERED),
+        'png_parallel': False,
+    },
+}
+DEFAULT_ENCODE_PROFILE = 'balanced'
 
 def read_image(path):
     stream = np.fromfile(path, dtype=np.uint8)
     img = cv2.imdecode(stream, cv2.IMREAD_COLOR)
     return img
 
-def save_image(path, img):
+def read_image_size(path):
+    """
+    Возвращает размер изображения (высота, ширина) по заголовку файла, не декодируя пиксели.
+    None - формат не распознан.
+    """
+    size = QImageReader(path).size()
+    if not size.isValid():
+        return None
+    return size.height(), size.width()
+
+def save_image(path, img, profile=DEFAULT_ENCODE_PROFILE):
+    """
+    Сохраняет изображение с параметрами кодирования из профиля ENCODE_PROFILES.
+    """
     ext = os.path.splitext(path)[1].lower()
+    settings = ENCODE_PROFILES[profile]
     
     params = []
     if ext in ['.jpg', '.jpeg']:
-        params = [cv2.IMWRITE_JPEG_QUALITY, 100]
+        params = settings['jpeg']
     elif ext == '.webp':
-        params = [cv2.IMWRITE_WEBP_QUALITY, 100]
+        params = settings['webp']
+    elif ext == '.png':
+        threads = min(get_cpu_threads()[1], MAX_ENCODE_THREADS)
+        if settings['png_parallel'] and threads > 1 and img.shape[0] * img.shape[1] >= PARALLEL_ENCODE_PIXELS:
+            with open(path, 'wb') as file:
+                file.write(encode_png_parallel(img, threads, *settings['zlib']))
+            return
+        params = settings['png']
         
     success, buffer = cv2.imencode(ext, img, params)
     if success:
-        buffer.tofile(path)
\ No newline at end of file
+        buffer.tofile(path)
+
+def filter_rows(rows:np.ndarray) -> np.ndarray:
+    """
+    Готовит строки BGR (N, W, 3) к сжатию в PNG: перевод в RGB и фильтр Sub
+    (каждый байт минус байт того же канала в соседнем слева пикселе, по модулю 256).
+    Возвращает массив (N, W * 3 + 1) с байтом типа фильтра в начале каждой строки.
+    """
+    n, width, _ = rows.shape
+    rgb = rows[:, :, ::-1]
+    
+    filtered = np.empty((n, width * 3 + 1), dtype=np.uint8)
+    filtered[:, 0] = 1
+    line = filtered[:, 1:].reshape(n, width, 3)
+    line[:, 0] = rgb[:, 0]
+    np.subtract(rgb[:, 1:], rgb[:, :-1], out=line[:, 1:])
+    return filtered
+
+def png_chunk(kind:bytes, data:bytes) -> bytes:
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)))
+
+def adler32_combine(adler1:int, adler2:int, length2:int) -> int:
+    """
+    Контрольная сумма Adler-32 склейки двух блоков по суммам блоков (как adler32_combine в zlib).
+    """
+    base = 65521
+    rem = length2 % base
+    sum1 = adler1 & 0xffff
+    sum2 = (rem * sum1 + (adler1 >> 16) + (adler2 >> 16) + base - rem) % base
+    sum1 = (sum1 + (adler2 & 0xffff) + base - 1) % base
+    return sum1 | (sum2 << 16)
+
+def encode_png_parallel(img:np.ndarray, threads:int, level:int = 1, strategy:int = zlib.Z_RLE) -> bytes:
+    """
+    Кодирует PNG полосами в нескольких потоках (zlib отпускает GIL на время сжатия).
+    Каждая полоса сжимается в отдельный поток deflate, закрытый синхронизирующим сбросом,
+    поэтому полосы склеиваются в один корректный zlib поток; Adler-32 собирается из сумм полос.
+    """
+    h, w, _ = img.shape
+    strip = max(1, -(-h // threads))
+    
+    def compress(y):
+        filtered = filter_rows(img[y:y + strip])
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, 8, strategy)
+        last = y + strip >= h
+        data = compressor.compress(filtered) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+        return data, zlib.adler32(filtered), filtered.size
+    
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        parts = list(pool.map(compress, range(0, h, strip)))
+    
+    adler = 1
+    chunks = [PNG_SIGNATURE, png_chunk(b'IHDR', struct.pack('>IIBBBBB', w, h, 8, 2, 0, 0, 0)), png_chunk(b'IDAT', b'\x78\x01')]
+    for data, part_adler, length in parts:
+        adler = adler32_combine(adler, part_adler, length)
+        chunks.append(png_chunk(b'IDAT', data))
+    chunks.append(png_chunk(b'IDAT', struct.pack('>I', adler)))
+    chunks.append(png_chunk(b'IEND', b''))
+    return b''.join(chunks)
+
+class PngStreamWriter:
+    """
+    Потоковая запись PNG (RGB, 8 бит) полосами строк, без хранения всего изображения в памяти.
+    Строки проходят фильтр Sub и сжимаются zlib, каждая полоса уходит в файл отдельным блоком IDAT.
+    Файл пишется во временный и переименовывается в close().
+    """
+    def __init__(self, path:str, width:int, height:int, level:int = 3, strategy:int = zlib.Z_DEFAULT_STRATEGY):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        
+        self.temp_path = f'{path}.tmp'
+        self.file = open(self.temp_path, 'wb')
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 8, strategy)
+        
+        self.file.write(PNG_SIGNATURE)
+        self.write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+    
+    def write_chunk(self, kind:bytes, data:bytes):
+        self.file.write(png_chunk(kind, data))
+    
+    def write(self, rows:np.ndarray):
+        """
+        Дописывает полосу строк (N, width, 3) в формате BGR (uint8).
+        """
+        data = self.compressor.compress(filter_rows(rows))
+        if data:
+            self.write_chunk(b'IDAT', data)
+        self.rows_written += rows.shape[0]
+    
+    def close(self):
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f'PNG stream has {self.rows_written} rows, expected {self.height}')
+        
+        self.write_chunk(b'IDAT', self.compressor.flush())
+        self.write_chunk(b'IEND', b'')
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+    
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+class MemmapImageWriter:
+    """
+    Запись полосами в холст, отображённый на файл в work_dir, с кодированием через OpenCV в close().
+    Для форматов, которые OpenCV не умеет писать потоково (JPEG, WEBP): страницы холста
+    хранит файловый кэш ОС, а не память процесса.
+    """
+    def __init__(self, path:str, width:int, height:int, work_dir:str, profile:str = DEFAULT_ENCODE_PROFILE):
+        self.path = path
+        self.profile = profile
+        self.rows_written = 0
+        self.canvas_path = os.path.join(work_dir, f'canvas_{os.getpid()}_{id(self)}.raw')
+        self.canvas = np.memmap(self.canvas_path, dtype=np.uint8, mode='w+', shape=(height, width, 3))
+    
+    def write(self, rows:np.ndarray):
+        self.canvas[self.rows_written:self.rows_written + rows.shape[0]] = rows
+        self.rows_written += rows.shape[0]
+    
+    def close(self):
+        try:
+            save_image(self.path, self.canvas, self.profile)
+        finally:
+            self.abort()
+    
+    def abort(self):
+        self.canvas = None # Отображение закрывается вместе с последней ссылкой на массив
+        if os.path.exists(self.canvas_path):
+            os.remove(self.canvas_path)
@@ -1,7 +1,16 @@
 import sys
 import os
+from PySide6.QtCore import QStandardPaths
 
 def get_resource_path(relative_path):
     if hasattr(sys, '_MEIPASS'):
         return os.path.join(sys._MEIPASS, relative_path)
-    return os.path.join(os.path.abspath('.'), relative_path)
\ No newline at end of file
+    return os.path.join(os.path.abspath('.'), relative_path)
+
+def get_cache_dir(name):
+    """
+    Возвращает папку кэша приложения для данных вида name (создаёт при необходимости).
+    """
+    path = os.path.join(QStandardPaths.writableLocation(QStandardPaths.StandardLocation.CacheLocation), name)
+    os.makedirs(path, exist_ok=True)
+    return path
\ No newline at end of file
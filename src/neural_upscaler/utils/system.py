@@ -1,5 +1,7 @@
 import onnxruntime as ort
 import subprocess
+import platform
+import hashlib
 import psutil
 import logging
 
@@ -78,4 +80,30 @@ def get_vram_limit():
         return target_limit
     except Exception as e:
         logging.error(f'Error getting RAM limit: {e}')
-        return 2 * GB_TO_BYTES
\ No newline at end of file
+        return 2 * GB_TO_BYTES
+        
+def get_cpu_threads():
+    """
+    Возвращает количество физических и логических ядер процессора.
+    """
+    logical = psutil.cpu_count(logical=True) or 1
+    physical = psutil.cpu_count(logical=False) or logical
+    return physical, logical
+
+def get_machine_fingerprint():
+    """
+    Возвращает короткий отпечаток конфигурации машины (процессор, память, GPU, версия ONNX Runtime).
+    Используется как ключ для сохранённых результатов замеров.
+    """
+    physical, logical = get_cpu_threads()
+    parts = [
+        platform.node(),
+        platform.machine(),
+        platform.processor(),
+        str(physical),
+        str(logical),
+        str(psutil.virtual_memory().total),
+        get_gpu_info(),
+        ort.__version__,
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()[:16]
\ No newline at end of file
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from onnx import helper, TensorProto, save
+from neural_upscaler.engine.upscaler import Upscaler
+from neural_upscaler.engine.tiling import TileReuseCache, tile_deviation
+
+@pytest.fixture(scope='module')
+def upscaler(tmp_path_factory):
+    """
+    Upscaler x2 на модели из одного Resize (ближайший сосед): результат легко проверить без настоящих весов.
+    """
+    path = str(tmp_path_factory.mktemp('model') / 'nearest_x2.onnx')
+    inp = helper.make_tensor_value_info('input', TensorProto.FLOAT, ['batch_size', 3, 'height', 'width'])
+    out = helper.make_tensor_value_info('output', TensorProto.FLOAT, ['batch_size', 3, 'out_height', 'out_width'])
+    scales = helper.make_tensor('scales', TensorProto.FLOAT, [4], [1, 1, 2, 2])
+    node = helper.make_node('Resize', ['input', '', 'scales'], ['output'], mode='nearest')
+    model = helper.make_model(helper.make_graph([node], 'nearest', [inp], [out], [scales]), opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 9
+    save(model, path)
+    
+    upscaler = Upscaler(path, 2, batch_size=None)
+    upscaler.tile_size = 64
+    return upscaler
+
+def test_tile_deviation_without_tiles():
+    assert tile_deviation(np.zeros((84, 84, 3), dtype=np.uint8), [], 10).shape == (0,)
+
+def test_identical_frames_reuse_all_tiles(upscaler):
+    frame = np.random.default_rng(0).integers(0, 255, (100, 150, 3), dtype=np.uint8)
+    frame[:, :50] = 128 # Однородная часть, чтобы в кадре были и плоские тайлы
+    cache = TileReuseCache()
+    
+    first = upscaler.process_image(frame, reuse=cache).copy()
+    second = upscaler.process_image(frame, reuse=cache)
+    
+    tiles = cache.total_tiles // 2
+    assert cache.reused_tiles == tiles
+    assert np.array_equal(first, second)
+    assert np.array_equal(second, upscaler.process_image(frame))